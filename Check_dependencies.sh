@@ -100,16 +100,27 @@ echo
 info "== 1) Check pipeline scripts exist (scr/01..05) =="
 need_file "$PROJECT_ROOT/scr/01_BIDS/participants.py"
 need_file "$PROJECT_ROOT/scr/01_BIDS/Parser_Bruker_file.py"
+need_file "$PROJECT_ROOT/scr/01_BIDS/manifest.py"
+need_file "$PROJECT_ROOT/scr/01_BIDS/nifti_writer.py"
+need_file "$PROJECT_ROOT/scr/01_BIDS/mask_store.py"
+need_file "$PROJECT_ROOT/scr/01_BIDS/work_queue.py"
+need_file "$PROJECT_ROOT/scr/01_BIDS/lease_check.py"
+need_file "$PROJECT_ROOT/scr/01_BIDS/watch_bruker.py"
+need_file "$PROJECT_ROOT/scr/01_BIDS/startup_budget.py"
 need_file "$PROJECT_ROOT/scr/02_reco/Brkraw_RARE.py"
-need_file "$PROJECT_ROOT/scr/02_reco/angio.sh"
+need_file "$PROJECT_ROOT/scr/02_reco/angio_stitch.py"
+need_file "$PROJECT_ROOT/scr/02_reco/reorient.py"
+need_file "$PROJECT_ROOT/scr/02_reco/t2star_fit.py"
 need_file "$PROJECT_ROOT/scr/03_masks/brain_extraction.py"
 need_file "$PROJECT_ROOT/scr/03_masks/mask_aaply.py"
 need_file "$PROJECT_ROOT/scr/03_masks/Mask_angio.py"
+need_file "$PROJECT_ROOT/scr/03_masks/ants_worker.py"
+need_file "$PROJECT_ROOT/scr/03_masks/ants_client.py"
 need_file "$PROJECT_ROOT/scr/04_align/Find_Matrice_SyN.sh"
-need_file "$PROJECT_ROOT/scr/04_align/Align_SyN.sh"
+need_file "$PROJECT_ROOT/scr/04_align/propagate.py"
+need_file "$PROJECT_ROOT/scr/04_align/roi_stats.py"
 need_file "$PROJECT_ROOT/scr/04_align/Seuil_T2star.sh"
 need_file "$PROJECT_ROOT/scr/05_templates/Template_v2.sh"
-need_file "$PROJECT_ROOT/scr/05_templates/apply_to_template.sh"
 need_file "$PROJECT_ROOT/scr/05_templates/Make_Template.sh"
 echo
 
@@ -124,7 +135,7 @@ done
 if [[ "$PYTHON_BIN" == */* ]]; then need_path_cmd "python" "$PYTHON_BIN"; else need_cmd "$PYTHON_BIN"; fi
 if [[ "$JULIA_BIN" == */* ]]; then need_path_cmd "julia" "$JULIA_BIN"; else need_cmd "$JULIA_BIN"; fi
 # tools used by pipeline
-for c in brkraw mrinfo mrconvert mrtransform mrgrid mrcat; do
+for c in brkraw mrinfo mrconvert mrtransform; do
   need_cmd "$c"
 done
 echo
@@ -174,6 +185,25 @@ if [[ " ${MISSING_PY[*]} " == *" ants "* ]]; then
   warn "If using conda/micromamba, try activating env and ensuring LD_LIBRARY_PATH includes <env>/lib."
 fi
 
+# Startup budget: heavy libraries (ants, antspynet/TensorFlow) must only load when a file is processed
+set +e
+"$PYTHON_BIN" "$PROJECT_ROOT/scr/01_BIDS/startup_budget.py" --python "$PYTHON_BIN"
+rc=$?
+set -e
+if [[ $rc -eq 0 ]]; then ok "Python startup budget OK"
+else warn "Python startup budget exceeded (see above; reruns will be slower)"
+fi
+
+# Leases shared between nodes: no task written twice, stale leases taken over safely
+set +e
+"$PYTHON_BIN" "$PROJECT_ROOT/scr/01_BIDS/lease_check.py"
+rc=$?
+set -e
+if [[ $rc -eq 0 ]]; then ok "Work queue leases OK"
+else warn "Work queue lease check failed (see above; do not run several nodes at once)"
+fi
+echo
+
 # ------------------------------------------------------------
 # 5) julia runtime + packages
 # ------------------------------------------------------------
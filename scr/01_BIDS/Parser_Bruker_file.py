@@ -5,13 +5,63 @@ import os
 import argparse
 from collections import OrderedDict
 
+import numpy as np
+
+# Nombre (entier, décimal ou notation scientifique)
+NUMBER_RE = re.compile(r"^-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?$")
+# Compression Bruker des répétitions : @<n>*(<valeur>)
+REPEAT_RE = re.compile(r"^@(\d+)\*\((.+)\)$")
+
 def find_file(parent_folder, filename):
     for root, dirs, files in os.walk(parent_folder):
         if filename in files:
             return os.path.join(root, filename)
     return None
 
-def parse_bruker_file(file_path):
+def parse_dims(inner):
+    """Dimensions déclarées dans ``##$KEY=( 3, 4 )`` -> (3, 4), ou None si non numériques."""
+    try:
+        return tuple(int(d) for d in inner.split(",") if d.strip())
+    except ValueError:
+        return None
+
+def decode_numeric_array(payload, dims=None):
+    """
+    Décode en bloc un contenu numérique Bruker en tableau NumPy typé
+    (int64 si possible, sinon float64), remis à la forme ``dims`` déclarée.
+    Retourne None si le contenu n'est pas entièrement numérique.
+    """
+    tokens = payload.split()
+    if not tokens:
+        return None
+    if any(t.startswith("@") for t in tokens):
+        expanded = []
+        for t in tokens:
+            m = REPEAT_RE.match(t)
+            expanded.extend([m.group(2)] * int(m.group(1)) if m else [t])
+        tokens = expanded
+    try:
+        arr = np.array(tokens, dtype=np.int64)
+    except ValueError:
+        try:
+            arr = np.array(tokens, dtype=np.float64)
+        except ValueError:
+            return None
+    if dims and int(np.prod(dims)) == arr.size:
+        arr = arr.reshape(dims)
+    arr.setflags(write=False)
+    return arr
+
+def parse_bruker_file(file_path, arrays=False):
+    """
+    Lit un fichier de paramètres Bruker (JCAMP-DX) et retourne un dict clé -> valeur.
+
+    Par défaut, les blocs numériques deviennent des listes de ``float`` (ou un
+    ``float`` seul). Avec ``arrays=True``, les valeurs déclarées ``( dims )``
+    sont décodées en bloc en tableaux NumPy typés, remis à la forme déclarée
+    (plus compacts pour ``ACQ_time_points``, tables de gradients, ``PVM_*``) ;
+    ils ne sont convertis en listes JSON qu'au moment de ``save_json``.
+    """
     metadata = {}
     with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
         lines = f.readlines()
@@ -44,9 +94,15 @@ def parse_bruker_file(file_path):
                         combined_value = " ".join(multi_line_value).strip()
                         if combined_value.startswith("<") and combined_value.endswith(">"):
                             combined_value = combined_value[1:-1].strip()
+                        elif arrays:
+                            value = decode_numeric_array(combined_value, parse_dims(inner))
+                            if value is not None:
+                                metadata[key] = value
+                                i = j
+                                continue
                         tokens = combined_value.split()
                         # Prise en compte des notations scientifiques
-                        if tokens and all(re.match(r"^-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?$", token) for token in tokens):
+                        if tokens and all(NUMBER_RE.match(token) for token in tokens):
                             nums = [float(token) for token in tokens]
                             value = nums if len(nums) > 1 else nums[0]
                         else:
@@ -54,7 +110,7 @@ def parse_bruker_file(file_path):
                         i = j
                     else:
                         tokens = inner.split(",")
-                        if tokens and all(re.match(r"^-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?$", t.strip()) for t in tokens):
+                        if tokens and all(NUMBER_RE.match(t.strip()) for t in tokens):
                             nums = [float(t.strip()) for t in tokens]
                             value = nums if len(nums) > 1 else nums[0]
                         else:
@@ -62,7 +118,7 @@ def parse_bruker_file(file_path):
                         i += 1
                 else:
                     tokens = inner.split(",")
-                    if tokens and all(re.match(r"^-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?$", t.strip()) for t in tokens):
+                    if tokens and all(NUMBER_RE.match(t.strip()) for t in tokens):
                         nums = [float(t.strip()) for t in tokens]
                         value = nums if len(nums) > 1 else nums[0]
                     else:
@@ -73,7 +129,7 @@ def parse_bruker_file(file_path):
                     value = value_str[1:-1].strip()
                 else:
                     tokens = value_str.split()
-                    if tokens and all(re.match(r"^-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?$", token) for token in tokens):
+                    if tokens and all(NUMBER_RE.match(token) for token in tokens):
                         nums = [float(token) for token in tokens]
                         value = nums if len(nums) > 1 else nums[0]
                     else:
@@ -174,7 +230,7 @@ def merge_acqp_data(bids, acqp_metadata):
         if acqp_key in acqp_metadata and new_key not in bids:
             val = acqp_metadata[acqp_key]
             if new_key == "AcquisitionTime":
-                if isinstance(val, list) and len(val) > 0:
+                if isinstance(val, (list, np.ndarray)) and len(val) > 0:
                     try:
                         ts = float(str(val[0]).replace(",", "."))
                         dt = datetime.datetime.utcfromtimestamp(ts).isoformat() + "Z"
@@ -293,10 +349,27 @@ def MP2RAGE(bids, p_MP2, inversion_time):
     bids["FlipAngle"] = p_MP2["α₁"] if inversion_time == p_MP2["TI₁"] else p_MP2["α₂"]
     return bids
 
+def to_json_compatible(value):
+    """
+    Couche de sérialisation BIDS : convertit les tableaux NumPy (mode ``arrays``)
+    en listes JSON, et les tableaux à un seul élément en scalaire (comme le mode liste).
+    """
+    if isinstance(value, np.ndarray):
+        if value.size == 1:
+            return value.reshape(()).item()
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return type(value)((k, to_json_compatible(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [to_json_compatible(v) for v in value]
+    return value
+
 def save_json(data, output_file):
     # Ajout du champ "units" avec la valeur "arbitary" si non présent
     data.setdefault("Units", "arbitrary")
-    ordered_data = reorder_keys(data)
+    ordered_data = to_json_compatible(reorder_keys(data))
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump(ordered_data, f, indent=4, ensure_ascii=False)
 
@@ -316,6 +389,7 @@ def main():
     parser.add_argument("--mode", default="MP2RAGE", help="Mode de reconstruction (par défaut MP2RAGE)")
     parser.add_argument("--mp2_file", default=None, help="Chemin vers le fichier JSON contenant les paramètres MP2RAGE")
     parser.add_argument("--json_name", default=None, help="Nom souhaité pour le fichier JSON de métadonnées (ex: sub-01_ses-01_MP2RAGE.json)")
+    parser.add_argument("--arrays", action="store_true", help="Décode les tableaux numériques en tableaux NumPy typés aux dimensions déclarées")
     args = parser.parse_args()
 
     parent_folder = args.parent_folder
@@ -352,10 +426,10 @@ def main():
             print("Fichier 'reco' introuvable.")
             exit(1)
 
-    visu_metadata = parse_bruker_file(visu_pars_file)
-    method_metadata = parse_bruker_file(method_file)
-    acqp_metadata = parse_bruker_file(acqp_file)
-    reco_metadata = parse_bruker_file(reco_file)
+    visu_metadata = parse_bruker_file(visu_pars_file, arrays=args.arrays)
+    method_metadata = parse_bruker_file(method_file, arrays=args.arrays)
+    acqp_metadata = parse_bruker_file(acqp_file, arrays=args.arrays)
+    reco_metadata = parse_bruker_file(reco_file, arrays=args.arrays)
 
     with open(method_file, 'r', encoding='utf-8', errors='ignore') as f:
         for line in f:
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Vérification des baux de ``work_queue`` (dans un dossier temporaire).
+
+- prises concurrentes : plusieurs processus se disputent les mêmes tâches,
+  chaque tâche doit être écrite exactement une fois ;
+- bail d'un processus disparu : repris par un autre processus ;
+- reprise puis libération puis nouvelle prise : le détenteur dépassé ne
+  retrouve pas son bail (génération jamais réutilisée), ses écritures gardées
+  sont refusées et sa libération ne touche pas au bail du nouveau détenteur.
+
+Exemple ::
+
+    python lease_check.py --processes 6 --tasks 20
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+import work_queue
+import nifti_writer
+
+
+def _worker(root, out_dir, n_tasks, results):
+    queue = work_queue.WorkQueue(root, "check", ttl=30)
+    written = []
+    for _ in range(3):
+        for t in range(n_tasks):
+            output = os.path.join(out_dir, f"task{t}")
+            if os.path.exists(output):
+                continue
+            lease = queue.claim(f"task{t}")
+            if lease is None:
+                continue
+            with lease:
+                if os.path.exists(output):
+                    continue
+                time.sleep(0.01)
+                if nifti_writer.write_bytes_atomic(b"ok", output, guard=lease.valid):
+                    written.append(f"task{t}")
+    results.put(written)
+
+
+def check_concurrent(root, processes, n_tasks):
+    out_dir = os.path.join(root, "outputs")
+    os.makedirs(out_dir)
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_worker, args=(root, out_dir, n_tasks, results))
+             for _ in range(processes)]
+    for p in procs:
+        p.start()
+    written = sum((results.get() for _ in procs), [])
+    for p in procs:
+        p.join()
+    return len(written) == n_tasks and len(set(written)) == n_tasks, \
+        f"{len(written)} écriture(s) pour {n_tasks} tâche(s)"
+
+
+def _claim_and_die(root):
+    work_queue.WorkQueue(root, "dead", ttl=30).claim("task")
+    os._exit(0)
+
+
+def check_dead_holder(root):
+    proc = multiprocessing.Process(target=_claim_and_die, args=(root,))
+    proc.start()
+    proc.join()
+    lease = work_queue.WorkQueue(root, "dead", ttl=30).claim("task")
+    if lease is None:
+        return False, "bail du processus disparu non repris"
+    lease.release()
+    return True, f"repris en génération {lease.generation}"
+
+
+def check_takeover_release_reclaim(root):
+    queue = work_queue.WorkQueue(root, "takeover", ttl=1)
+    old = queue.claim("task")
+    # Détenteur bloqué : plus de battement de cœur, bail expiré
+    old._stop.set()
+    old._thread.join()
+    os.utime(old.path, (0, 0))
+
+    newer = queue.claim("task")
+    newer.release()
+    current = queue.claim("task")
+    problems = []
+    if current is None or current.generation == old.generation:
+        problems.append("génération réutilisée")
+    if old.valid():
+        problems.append("le détenteur dépassé se croit valide")
+    output = os.path.join(root, "takeover_output")
+    if nifti_writer.write_bytes_atomic(b"old", output, guard=old.valid) is not None or os.path.exists(output):
+        problems.append("écriture du détenteur dépassé acceptée")
+    old.release()
+    if current is not None and queue.read(current.path).get("token") != current.token:
+        problems.append("bail courant supprimé par l'ancien détenteur")
+    if queue.claim("task") is not None:
+        problems.append("tâche reprise pendant que le détenteur courant travaille")
+    if current is not None:
+        current.release()
+    return not problems, "; ".join(problems) or f"génération {old.generation} -> {current.generation}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vérifie les baux de la file de travail (work_queue.py).")
+    parser.add_argument("--processes", type=int, default=6, help="Processus concurrents (défaut : 6)")
+    parser.add_argument("--tasks", type=int, default=20, help="Nombre de tâches (défaut : 20)")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="lease_check-")
+    os.environ["FC3R_LEASE_DIR"] = os.path.join(root, ".leases")
+    checks = [
+        ("prises concurrentes", lambda: check_concurrent(root, args.processes, args.tasks)),
+        ("processus disparu", lambda: check_dead_holder(root)),
+        ("reprise / libération / nouvelle prise", lambda: check_takeover_release_reclaim(root)),
+    ]
+    failures = 0
+    try:
+        for name, check in checks:
+            ok, detail = check()
+            print(f"{'✅' if ok else '❌'} {name:40s} {detail}")
+            failures += not ok
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
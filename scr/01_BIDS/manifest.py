@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Manifeste SQLite des fichiers BIDS et derivatives.
+
+Chaque fichier est indexé avec ses entités (sub, ses, acq, run), sa modalité
+(suffixe BIDS, ex. T2map), sa description (ex. ``masked``, ``mask_final``),
+son étape (``raw``, ``masks``, ``brain_extracted``, ``alignedSyN``...), sa
+taille et sa date de modification.
+
+- ``scan`` parcourt l'arborescence une fois (mise à jour incrémentale) ;
+- ``record`` est appelé par les scripts Python qui écrivent des sorties ;
+- ``query`` répond par une requête indexée au lieu de re-parcourir le disque.
+
+Le disque reste la référence : la date de modification de chaque dossier est
+gardée dans le manifeste, et ``query`` commence par ``refresh``, qui ne relit
+que les dossiers dont la date a changé (fichier créé, renommé ou supprimé par
+n'importe quel outil : Julia, Bash, ``cp``, ANTs...). Un fichier absent du
+manifeste parce qu'un écrivain ne l'a pas enregistré est donc retrouvé à la
+requête suivante, pour le prix d'un ``stat`` par dossier.
+
+Un manifeste par nœud : ``<BIDS>/derivatives/.manifest/<hôte>.sqlite`` (ou
+``$FC3R_MANIFEST``). Les nœuds qui partagent l'arborescence (NFS) n'écrivent
+jamais dans la même base — le verrouillage SQLite n'est pas fiable sur NFS —
+et chaque base se reconstruit depuis le disque.
+
+Exemple ::
+
+    python manifest.py scan BIDS
+    python manifest.py query BIDS --stage brain_extracted --modality T2map --ses ses-3
+"""
+
+import os
+import re
+import sys
+import socket
+import sqlite3
+import argparse
+
+ENTITY_RE = re.compile(r"^(sub|ses|acq|run|inv|echo|part)-(.+)$")
+EXTENSIONS = (".nii.gz", ".nii", ".json", ".tsv", ".mat", ".mif")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    relpath  TEXT PRIMARY KEY,
+    sub      TEXT,
+    ses      TEXT,
+    acq      TEXT,
+    run      TEXT,
+    modality TEXT,
+    desc     TEXT,
+    stage    TEXT,
+    ext      TEXT,
+    size     INTEGER,
+    mtime    REAL
+);
+CREATE INDEX IF NOT EXISTS idx_files_stage ON files (stage, modality, ses);
+CREATE INDEX IF NOT EXISTS idx_files_subses ON files (sub, ses);
+CREATE INDEX IF NOT EXISTS idx_files_modality ON files (modality, desc);
+CREATE TABLE IF NOT EXISTS dirs (
+    relpath  TEXT PRIMARY KEY,
+    mtime_ns INTEGER
+);
+"""
+
+COLUMNS = ("relpath", "sub", "ses", "acq", "run", "modality", "desc", "stage", "ext", "size", "mtime")
+FILTERS = ("sub", "ses", "acq", "run", "modality", "desc", "stage", "ext")
+
+
+def manifest_path(root):
+    """Chemin du manifeste pour la racine BIDS ``root``."""
+    return os.environ.get("FC3R_MANIFEST") or os.path.join(
+        root, "derivatives", ".manifest", f"{socket.gethostname()}.sqlite")
+
+
+def connect(root):
+    """Ouvre (et crée si besoin) le manifeste de ``root``."""
+    db_path = manifest_path(root)
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    db = sqlite3.connect(db_path, timeout=60)
+    db.executescript(SCHEMA)
+    return db
+
+
+def find_bids_root(path):
+    """Remonte depuis ``path`` jusqu'au dossier parent de ``derivatives`` / ``sub-*`` le plus haut."""
+    parts = os.path.abspath(path).split(os.sep)
+    for i, part in enumerate(parts):
+        if part == "derivatives" or part.startswith("sub-"):
+            return os.sep.join(parts[:i]) or os.sep
+    return None
+
+
+def split_ext(name):
+    for ext in EXTENSIONS:
+        if name.endswith(ext):
+            return name[:-len(ext)], ext
+    return os.path.splitext(name)
+
+
+def parse_entities(relpath):
+    """
+    Déduit entités, modalité, description et étape d'un chemin relatif à la racine BIDS.
+
+    ``sub-01_ses-3_T2map_masked.nii.gz`` dans ``derivatives/Brain_extracted/T2map``
+    -> sub=sub-01, ses=ses-3, modality=T2map, desc=masked, stage=brain_extracted.
+    """
+    parts = relpath.split(os.sep)
+    stem, ext = split_ext(parts[-1])
+
+    info = dict.fromkeys(FILTERS)
+    info["ext"] = ext
+
+    tokens = stem.split("_")
+    i = 0
+    while i < len(tokens):
+        m = ENTITY_RE.match(tokens[i])
+        if not m:
+            break
+        if m.group(1) in ("sub", "ses"):
+            info[m.group(1)] = tokens[i]
+        elif m.group(1) in ("acq", "run"):
+            info[m.group(1)] = m.group(2)
+        i += 1
+    if i < len(tokens):
+        info["modality"] = tokens[i]
+        info["desc"] = "_".join(tokens[i + 1:]) or None
+
+    dirs = parts[:-1]
+    if not dirs or dirs[0] != "derivatives":
+        info["stage"] = "raw"
+    elif len(dirs) > 1 and dirs[1].startswith("sub-"):
+        info["stage"] = "masks_step" if "step" in dirs else "masks"
+    elif len(dirs) > 2 and dirs[1] == "Brain_extracted":
+        if info["modality"] is None:
+            info["modality"] = dirs[2]
+        info["stage"] = "brain_extracted" if len(dirs) == 3 else dirs[3]
+    else:
+        info["stage"] = dirs[1] if len(dirs) > 1 else "derivatives"
+    return info
+
+
+def _row(root, relpath, st):
+    info = parse_entities(relpath)
+    info.update(relpath=relpath, size=st.st_size, mtime=st.st_mtime)
+    return tuple(info[c] for c in COLUMNS)
+
+
+def _upsert(db, rows):
+    db.executemany(
+        f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+        rows,
+    )
+
+
+def _list_dir(root, rel_dir, db_name):
+    """
+    Contenu direct de ``rel_dir`` : (date du dossier en ns, ``{relpath: stat}``
+    des fichiers, sous-dossiers). Les entrées cachées sont ignorées (baux, manifeste...).
+    """
+    full_dir = os.path.join(root, rel_dir)
+    # Date lue avant le contenu : un fichier ajouté pendant la lecture sera revu au prochain refresh
+    mtime_ns = os.stat(full_dir).st_mtime_ns
+    files, subdirs = {}, []
+    with os.scandir(full_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            relpath = os.path.normpath(os.path.join(rel_dir, entry.name))
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(relpath)
+            elif entry.is_file() and not entry.name.startswith(db_name):
+                files[relpath] = entry.stat()
+    return mtime_ns, files, sorted(subdirs)
+
+
+def _sync(db, root, start_dirs, known, known_dirs, recurse_all, prune=True):
+    """
+    Relit les dossiers ``start_dirs`` et, récursivement, leurs sous-dossiers
+    nouveaux (tous si ``recurse_all``). Met à jour ``files`` et ``dirs`` (fichiers
+    disparus retirés si ``prune``) ; retourne (ajoutés/modifiés, retirés, dossiers relus).
+    """
+    db_name = os.path.basename(manifest_path(root))
+    children = {}
+    for relpath in known:
+        children.setdefault(os.path.dirname(relpath) or ".", []).append(relpath)
+
+    rows, removed, dir_rows, seen_dirs = [], [], [], set()
+    stack = list(start_dirs)
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            mtime_ns, files, subdirs = _list_dir(root, rel_dir, db_name)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        seen_dirs.add(rel_dir)
+        dir_rows.append((rel_dir, mtime_ns))
+        rows.extend(_row(root, p, st) for p, st in files.items()
+                    if known.get(p) != (st.st_size, st.st_mtime))
+        if prune:
+            removed.extend(p for p in children.get(rel_dir, ()) if p not in files)
+        stack.extend(d for d in subdirs if recurse_all or d not in known_dirs)
+
+    with db:
+        _upsert(db, rows)
+        db.executemany("DELETE FROM files WHERE relpath = ?", [(p,) for p in removed])
+        db.executemany("INSERT OR REPLACE INTO dirs (relpath, mtime_ns) VALUES (?, ?)", dir_rows)
+    return len(rows), len(removed), seen_dirs
+
+
+def _forget_dirs(db, known, rel_dirs):
+    """Retire du manifeste les dossiers disparus et les fichiers qu'ils contenaient."""
+    rel_dirs = set(rel_dirs)
+    gone = [p for p in known if (os.path.dirname(p) or ".") in rel_dirs]
+    with db:
+        db.executemany("DELETE FROM files WHERE relpath = ?", [(p,) for p in gone])
+        db.executemany("DELETE FROM dirs WHERE relpath = ?", [(d,) for d in rel_dirs])
+    return len(gone)
+
+
+def _load(db):
+    known = {r[0]: (r[1], r[2]) for r in db.execute("SELECT relpath, size, mtime FROM files")}
+    known_dirs = {r[0]: r[1] for r in db.execute("SELECT relpath, mtime_ns FROM dirs")}
+    return known, known_dirs
+
+
+def scan(root, prune=True):
+    """
+    Parcourt ``root`` et met à jour le manifeste (seuls les fichiers nouveaux ou
+    modifiés sont réécrits ; les fichiers disparus sont retirés si ``prune``).
+    """
+    root = os.path.abspath(root)
+    db = connect(root)
+    known, known_dirs = _load(db)
+    updated, removed, seen_dirs = _sync(db, root, ["."], known, known_dirs, recurse_all=True, prune=prune)
+    if prune:
+        removed += _forget_dirs(db, _load(db)[0], [d for d in known_dirs if d not in seen_dirs])
+    db.close()
+    return updated, removed
+
+
+def refresh(root):
+    """
+    Remet le manifeste en accord avec le disque en ne relisant que les dossiers
+    dont la date a changé (ou nouveaux) ; parcours complet si la base est vide.
+    Retourne (fichiers ajoutés/modifiés, fichiers retirés).
+    """
+    root = os.path.abspath(root)
+    db = connect(root)
+    known, known_dirs = _load(db)
+    if not known_dirs:
+        db.close()
+        return scan(root)
+
+    changed, missing = [], []
+    for rel_dir, mtime_ns in known_dirs.items():
+        try:
+            if os.stat(os.path.join(root, rel_dir)).st_mtime_ns != mtime_ns:
+                changed.append(rel_dir)
+        except FileNotFoundError:
+            missing.append(rel_dir)
+
+    updated = removed = 0
+    if changed:
+        updated, removed, _ = _sync(db, root, changed, known, known_dirs, recurse_all=False)
+    if missing:
+        removed += _forget_dirs(db, known, missing)
+    db.close()
+    return updated, removed
+
+
+def record(paths, root=None):
+    """
+    Enregistre (ou met à jour) des sorties venant d'être écrites.
+
+    Ne lève jamais d'exception : un manifeste indisponible ne doit pas
+    interrompre le traitement. L'échec est signalé sur stderr ; les fichiers
+    non enregistrés sont retrouvés par le prochain ``refresh``.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    try:
+        paths = [os.path.abspath(p) for p in paths if p and os.path.exists(p)]
+        if not paths:
+            return 0
+        root = os.path.abspath(root) if root else find_bids_root(paths[0])
+        if root is None:
+            return 0
+        db = connect(root)
+        with db:
+            _upsert(db, [_row(root, os.path.relpath(p, root), os.stat(p)) for p in paths])
+        db.close()
+        return len(paths)
+    except Exception as e:
+        print(f"⚠️  Manifeste non mis à jour ({len(paths)} fichier(s), ex. {paths[0] if paths else '-'}) : "
+              f"{type(e).__name__}: {e}", file=sys.stderr)
+        return 0
+
+
+def query(root, fresh=True, **filters):
+    """
+    Retourne les chemins absolus des fichiers correspondant aux filtres.
+
+    Chaque filtre (sub, ses, acq, run, modality, desc, stage, ext) accepte une
+    valeur ou une liste de valeurs ; ``desc=""`` sélectionne les fichiers sans description.
+    Si ``fresh``, le manifeste est d'abord remis à jour (``refresh``) : les
+    fichiers écrits hors Python (Julia, Bash) sont pris en compte.
+    """
+    root = os.path.abspath(root)
+    if fresh:
+        try:
+            refresh(root)
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️  Manifeste non rafraîchi ({manifest_path(root)}) : {type(e).__name__}: {e}", file=sys.stderr)
+    clauses, params = [], []
+    for key, value in filters.items():
+        if key not in FILTERS:
+            raise ValueError(f"Filtre inconnu : {key}")
+        if value is None:
+            continue
+        values = [value] if isinstance(value, str) else list(value)
+        if values == [""]:
+            clauses.append(f"{key} IS NULL")
+            continue
+        clauses.append(f"{key} IN ({', '.join('?' * len(values))})")
+        params.extend(values)
+
+    sql = "SELECT relpath FROM files"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY relpath"
+
+    db = connect(root)
+    paths = [os.path.join(root, r[0]) for r in db.execute(sql, params)]
+    db.close()
+    return paths
+
+
+def exists(root):
+    """Vrai si le manifeste de ``root`` a déjà été construit."""
+    return os.path.exists(manifest_path(root))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manifeste SQLite des fichiers BIDS / derivatives.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_scan = sub.add_parser("scan", help="Construit / met à jour le manifeste")
+    p_scan.add_argument("root", help="Racine BIDS")
+    p_scan.add_argument("--no-prune", action="store_true", help="Ne pas retirer les fichiers disparus")
+
+    p_record = sub.add_parser("record", help="Enregistre des fichiers écrits")
+    p_record.add_argument("paths", nargs="+")
+    p_record.add_argument("--root", default=None)
+
+    p_query = sub.add_parser("query", help="Liste les fichiers correspondant aux filtres")
+    p_query.add_argument("root", help="Racine BIDS")
+    p_query.add_argument("--no-refresh", action="store_true",
+                         help="Interroge le manifeste tel quel, sans relire les dossiers modifiés")
+    for key in FILTERS:
+        p_query.add_argument(f"--{key}", action="append", default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "scan":
+        updated, removed = scan(args.root, prune=not args.no_prune)
+        print(f"✔ Manifeste à jour : {updated} fichier(s) ajouté(s)/modifié(s), {removed} retiré(s)", file=sys.stderr)
+    elif args.command == "record":
+        record(args.paths, args.root)
+    elif args.command == "query":
+        for path in query(args.root, fresh=not args.no_refresh, **{k: getattr(args, k) for k in FILTERS}):
+            print(path)
+
+
+if __name__ == "__main__":
+    main()
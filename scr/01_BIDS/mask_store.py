@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Stockage compact des masques cérébraux finaux.
+
+``brain_extraction.py`` publie, à côté de chaque ``*_RARE_mask_final.nii.gz``,
+un ``*_RARE_mask_final.npz`` non compressé contenant :
+
+- ``shape`` et ``affine`` (RAS, comme nibabel) de la grille du masque ;
+- ``indices`` : liste triée des voxels du cerveau (indices à plat, ordre C) ;
+- ``bbox`` : boîte englobante ``[[i0, j0, k0], [i1, j1, k1]]`` (bornes exclusives) ;
+- ``packed`` : le masque restreint à la boîte, compacté bit à bit (``np.packbits``).
+
+Les membres étant stockés sans compression, ils sont projetés en mémoire
+(``np.memmap``) directement depuis l'archive : le chargement ne décompresse
+rien et les consommateurs (``mask_aaply.py``, ``Mask_angio.py``,
+``t2star_fit.py``) ne touchent que les voxels du cerveau.
+
+Exemple ::
+
+    python mask_store.py publish BIDS/derivatives/sub-*/ses-*/anat/*_RARE_mask_final.nii.gz
+"""
+
+import os
+import sys
+import struct
+import zipfile
+import argparse
+
+import numpy as np
+
+import nifti_writer
+
+# Seuil de binarisation (``mask > 0.5`` dans Mask_angio.py ; les masques finaux valent 0/1)
+THRESHOLD = 0.5
+
+# Passage LPS (ITK / ANTs) <-> RAS (nibabel)
+LPS_TO_RAS = np.diag([-1.0, -1.0, 1.0])
+
+
+def store_path(mask_path):
+    """``..._mask_final.nii.gz`` -> ``..._mask_final.npz``."""
+    for ext in (".nii.gz", ".nii"):
+        if mask_path.endswith(ext):
+            return mask_path[:-len(ext)] + ".npz"
+    return os.path.splitext(mask_path)[0] + ".npz"
+
+
+def affine_from_itk(origin, spacing, direction):
+    """Affine RAS (nibabel) à partir de la géométrie ITK d'une ``ANTsImage``."""
+    affine = np.eye(4)
+    affine[:3, :3] = LPS_TO_RAS @ np.asarray(direction, dtype=float) @ np.diag(spacing)
+    affine[:3, 3] = LPS_TO_RAS @ np.asarray(origin, dtype=float)
+    return affine
+
+
+def itk_from_affine(affine):
+    """Géométrie ITK (``origin``, ``spacing``, ``direction``) d'une affine RAS."""
+    affine = np.asarray(affine, dtype=float)
+    spacing = np.linalg.norm(affine[:3, :3], axis=0)
+    direction = LPS_TO_RAS @ affine[:3, :3] / spacing
+    origin = LPS_TO_RAS @ affine[:3, 3]
+    return {"origin": tuple(origin), "spacing": tuple(spacing), "direction": direction}
+
+
+class CompactMask:
+    """Masque binaire sous forme de liste de voxels + boîte englobante."""
+
+    def __init__(self, shape, affine, indices, bbox, packed=None):
+        self.shape = tuple(int(s) for s in shape)
+        self.affine = np.asarray(affine, dtype=float)
+        self.indices = indices
+        self.bbox = np.asarray(bbox, dtype=int)
+        self.packed = packed
+        self._coords = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    def coords(self):
+        """Coordonnées ``(i, j, k)`` des voxels du cerveau (même ordre que ``data[mask]``)."""
+        if self._coords is None:
+            self._coords = np.unravel_index(np.asarray(self.indices), self.shape)
+        return self._coords
+
+    def bbox_slices(self):
+        return tuple(slice(lo, hi) for lo, hi in zip(self.bbox[0], self.bbox[1]))
+
+    def to_dense(self):
+        """Masque booléen complet (reconstruit depuis la boîte et les bits)."""
+        dense = np.zeros(self.shape, dtype=bool)
+        if self.packed is not None:
+            box_shape = tuple(self.bbox[1] - self.bbox[0])
+            box = np.unpackbits(np.asarray(self.packed), count=int(np.prod(box_shape))).astype(bool)
+            dense[self.bbox_slices()] = box.reshape(box_shape)
+        else:
+            dense[self.coords()] = True
+        return dense
+
+    def values(self, data):
+        """Valeurs de ``data`` (x, y, z[, ...]) aux voxels du cerveau : tableau (n[, ...])."""
+        return np.asanyarray(data)[self.coords()]
+
+    def apply(self, data, dtype=None):
+        """Copie de ``data`` nulle hors du cerveau (seuls les voxels du masque sont lus)."""
+        data = np.asanyarray(data)
+        out = np.zeros(data.shape, dtype=dtype or data.dtype)
+        coords = self.coords()
+        out[coords] = data[coords]
+        return out
+
+    def itk_geometry(self):
+        return itk_from_affine(self.affine)
+
+
+def from_array(data, affine, threshold=THRESHOLD):
+    """Construit un ``CompactMask`` à partir d'un volume (voxels ``> threshold``)."""
+    binary = np.asanyarray(data) > threshold
+    indices = np.flatnonzero(binary)
+    indices = indices.astype(np.int32 if binary.size < 2 ** 31 else np.int64)
+    if len(indices):
+        nz = np.nonzero(binary)
+        bbox = np.array([[c.min() for c in nz], [c.max() + 1 for c in nz]])
+    else:
+        bbox = np.zeros((2, binary.ndim), dtype=int)
+    box = binary[tuple(slice(lo, hi) for lo, hi in zip(bbox[0], bbox[1]))]
+    return CompactMask(binary.shape, affine, indices, bbox, np.packbits(box, axis=None))
+
+
+def save(mask, path, guard=None):
+    """
+    Écrit ``mask`` (``CompactMask``) dans ``path`` (``.npz`` non compressé, écriture atomique).
+    ``guard`` : comme pour ``nifti_writer.write_bytes_atomic`` (None si rien n'est écrit).
+    """
+    output_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(output_dir, exist_ok=True)
+    tmp_path = nifti_writer.tmp_path(path, ".npz")
+    try:
+        np.savez(tmp_path, shape=np.asarray(mask.shape, dtype=np.int64), affine=mask.affine,
+                 indices=mask.indices, bbox=mask.bbox, packed=mask.packed)
+        if guard is not None and not guard():
+            return None
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def publish_array(data, affine, mask_path, threshold=THRESHOLD, guard=None):
+    """Publie le stockage compact du masque ``mask_path`` à partir de son volume."""
+    return save(from_array(data, affine, threshold), store_path(mask_path), guard)
+
+
+def publish_ants(image, mask_path, threshold=THRESHOLD, guard=None):
+    """Publie le stockage compact à partir d'une ``ANTsImage`` (sans relire le NIfTI)."""
+    affine = affine_from_itk(image.origin, image.spacing, image.direction)
+    return publish_array(image.numpy(), affine, mask_path, threshold, guard)
+
+
+def _mmap_member(path, name):
+    """Projette en mémoire le membre ``name`` (non compressé) d'une archive ``.npz``."""
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(name + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(path, "rb") as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_len, extra_len = struct.unpack("<HH", local_header[26:30])
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if dtype.hasobject or 0 in shape:
+        return None
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape,
+                     order="F" if fortran_order else "C")
+
+
+def load(path, mmap=True):
+    """Charge un stockage compact ; ``indices`` et ``packed`` sont projetés en mémoire."""
+    with np.load(path) as npz:
+        shape = tuple(npz["shape"])
+        affine = npz["affine"]
+        bbox = npz["bbox"]
+        indices = _mmap_member(path, "indices") if mmap else None
+        packed = _mmap_member(path, "packed") if mmap else None
+        if indices is None:
+            indices = npz["indices"]
+        if packed is None:
+            packed = npz["packed"]
+    return CompactMask(shape, affine, indices, bbox, packed)
+
+
+def load_for(mask_path):
+    """
+    Stockage compact associé au NIfTI ``mask_path`` s'il existe et n'est pas plus
+    ancien que le NIfTI ; sinon None (le consommateur relit le NIfTI).
+    """
+    path = store_path(mask_path)
+    if not os.path.exists(path):
+        return None
+    if os.path.exists(mask_path) and os.path.getmtime(path) < os.path.getmtime(mask_path):
+        return None
+    try:
+        return load(path)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+        print(f"⚠️  Stockage compact illisible ({path}) : {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stockage compact (voxels + boîte englobante) des masques finaux.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_publish = sub.add_parser("publish", help="Crée le .npz de masques NIfTI existants")
+    p_publish.add_argument("masks", nargs="+")
+    p_publish.add_argument("--threshold", type=float, default=THRESHOLD)
+
+    p_info = sub.add_parser("info", help="Affiche le contenu d'un .npz")
+    p_info.add_argument("store")
+
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        import nibabel as nib
+        for mask_path in args.masks:
+            img = nib.load(mask_path)
+            path = publish_array(np.asanyarray(img.dataobj), img.affine, mask_path, args.threshold)
+            print(f"✔ {path}")
+    elif args.command == "info":
+        mask = load(args.store)
+        print(f"shape={mask.shape} voxels={len(mask)} bbox={mask.bbox.tolist()}", file=sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
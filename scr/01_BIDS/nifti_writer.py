@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Écriture NIfTI commune à toutes les étapes Python.
+
+- compression gzip parallèle par blocs (façon ``pigz``) : le volume est découpé
+  en blocs compressés sur plusieurs threads, chacun formant un membre gzip ;
+  les membres concaténés restent un ``.nii.gz`` standard (lu par nibabel, ANTs,
+  MRtrix, FSL...) ;
+- niveau de compression par classe de sortie : ``intermediate`` (étapes,
+  fichiers temporaires : rapide) ou ``final`` (dérivés conservés : fort) ;
+- écriture dans un fichier temporaire du même dossier puis ``os.replace`` :
+  une sortie n'apparaît qu'une fois complète.
+
+Accepte indifféremment une image nibabel ou une ``ANTsImage`` (sans importer ``ants``).
+
+Variables d'environnement : ``FC3R_GZIP_LEVEL_INTERMEDIATE``,
+``FC3R_GZIP_LEVEL_FINAL``, ``FC3R_GZIP_THREADS``.
+"""
+
+import os
+import gzip
+import uuid
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+COMPRESSION_LEVELS = {
+    "intermediate": int(os.environ.get("FC3R_GZIP_LEVEL_INTERMEDIATE", 1)),
+    "final": int(os.environ.get("FC3R_GZIP_LEVEL_FINAL", 9)),
+}
+
+# Taille des blocs compressés indépendamment (perte de ratio négligeable au-delà de quelques Mo)
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def gzip_threads():
+    return int(os.environ.get("FC3R_GZIP_THREADS") or os.cpu_count() or 1)
+
+
+def gzip_blocks(raw, level=6, threads=None, block_size=BLOCK_SIZE):
+    """
+    Compresse ``raw`` en membres gzip concaténés, un par bloc de ``block_size``
+    octets, sur ``threads`` threads (zlib libère le GIL).
+    """
+    view = memoryview(raw)
+    blocks = [view[i:i + block_size] for i in range(0, len(view), block_size)] or [view]
+    threads = min(threads or gzip_threads(), len(blocks))
+    if threads <= 1:
+        return b"".join(gzip.compress(b, compresslevel=level, mtime=0) for b in blocks)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return b"".join(pool.map(lambda b: gzip.compress(b, compresslevel=level, mtime=0), blocks))
+
+
+def tmp_path(output_path, suffix=""):
+    """
+    Fichier temporaire caché à côté de ``output_path``, unique même entre nœuds
+    partageant l'arborescence (hôte + identifiant aléatoire, pas seulement le PID).
+    """
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    tag = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+    return os.path.join(output_dir, f".{os.path.basename(output_path)}.tmp-{tag}{suffix}")
+
+
+def write_bytes_atomic(data, output_path, guard=None):
+    """
+    Écrit ``data`` dans un fichier temporaire du même dossier puis le renomme.
+
+    ``guard`` : fonction appelée juste avant le renommage (ex : ``Lease.valid``) ;
+    si elle retourne faux, la sortie n'est pas remplacée et la fonction retourne None.
+    """
+    tmp_file = tmp_path(output_path)
+    try:
+        with open(tmp_file, "wb") as f:
+            f.write(data)
+        if guard is not None and not guard():
+            return None
+        os.replace(tmp_file, output_path)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return output_path
+
+
+def _ants_to_bytes(image, output_path):
+    """Sérialise une ``ANTsImage`` (en-tête ITK inchangé) via un ``.nii`` non compressé."""
+    tmp_nii = tmp_path(output_path, ".nii")
+    try:
+        image.to_file(tmp_nii)
+        with open(tmp_nii, "rb") as f:
+            return f.read()
+    finally:
+        if os.path.exists(tmp_nii):
+            os.remove(tmp_nii)
+
+
+def save(image, output_path, output_class="final", threads=None, guard=None):
+    """
+    Écrit ``image`` (nibabel ou ANTs) dans ``output_path``.
+
+    ``.nii.gz`` : compression parallèle au niveau de ``output_class``
+    (``intermediate`` ou ``final``) ; ``.nii`` : sans compression.
+    ``guard`` : voir ``write_bytes_atomic`` (None si la sortie n'a pas été écrite).
+    """
+    if output_class not in COMPRESSION_LEVELS:
+        raise ValueError(f"Classe de sortie inconnue : {output_class}")
+
+    # nibabel n'est chargé qu'à la première écriture (démarrage rapide des scripts)
+    import nibabel as nib
+
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+
+    if isinstance(image, nib.spatialimages.SpatialImage):
+        raw = image.to_bytes()
+    else:
+        raw = _ants_to_bytes(image, output_path)
+
+    if output_path.endswith(".gz"):
+        raw = gzip_blocks(raw, COMPRESSION_LEVELS[output_class], threads)
+    return write_bytes_atomic(raw, output_path, guard)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Budget de démarrage des points d'entrée Python.
+
+Chaque script est lancé avec ``python -X importtime <script> --help`` : on
+mesure le temps d'import cumulé (modules de premier niveau) et on vérifie
+qu'aucune bibliothèque lourde (``ants``, ``antspynet``/TensorFlow, ...) n'est
+chargée avant qu'un fichier ait réellement besoin d'être traité. Une relance
+du pipeline dont tout le travail est déjà fait reste ainsi de l'ordre de la seconde.
+
+Le worker ANTs (``ants_worker.py``) n'est pas concerné : il charge ANTs et le
+modèle une fois pour toutes au démarrage.
+
+Exemple ::
+
+    python startup_budget.py --budget 0.5
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+
+SCR_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# Budget d'import par script (secondes)
+DEFAULT_BUDGET = float(os.environ.get("FC3R_IMPORT_BUDGET", 1.0))
+
+# Script -> modules qui ne doivent pas être importés au démarrage
+ENTRY_POINTS = {
+    "01_BIDS/manifest.py": ("numpy",),
+    "01_BIDS/work_queue.py": ("numpy",),
+    "01_BIDS/mask_store.py": ("nibabel",),
+    "01_BIDS/watch_bruker.py": ("numpy", "ants"),
+    "03_masks/ants_client.py": ("numpy", "ants"),
+    "03_masks/brain_extraction.py": ("ants", "antspynet", "tensorflow"),
+    "03_masks/mask_aaply.py": ("ants", "nibabel"),
+    "03_masks/Mask_angio.py": ("ants", "nibabel"),
+    "04_align/propagate.py": ("ants",),
+    "04_align/roi_stats.py": ("ants",),
+}
+
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_importtime(stderr):
+    """Sortie ``-X importtime`` -> (temps cumulé des imports de premier niveau en s, modules importés)."""
+    total_us, modules = 0, set()
+    for line in stderr.splitlines():
+        m = IMPORTTIME_RE.match(line)
+        if not m:
+            continue
+        modules.add(m.group(4))
+        # Un seul espace d'indentation : import de premier niveau
+        if len(m.group(3)) == 1:
+            total_us += int(m.group(2))
+    return total_us / 1e6, modules
+
+
+def measure(script, python=sys.executable):
+    """Lance ``script --help`` et retourne (temps d'import, durée totale, modules importés, code retour)."""
+    start = time.perf_counter()
+    proc = subprocess.run([python, "-X", "importtime", script, "--help"],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - start
+    import_s, modules = parse_importtime(proc.stderr)
+    return import_s, wall, modules, proc.returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vérifie le temps de démarrage (imports) des scripts Python.")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help=f"Temps d'import maximal par script en secondes (défaut : {DEFAULT_BUDGET})")
+    parser.add_argument("--python", default=sys.executable, help="Interpréteur à utiliser")
+    args = parser.parse_args()
+
+    failures = 0
+    for rel_path, forbidden in ENTRY_POINTS.items():
+        script = os.path.join(SCR_DIR, rel_path)
+        if not os.path.isfile(script):
+            print(f"❗ Script absent : {rel_path}")
+            failures += 1
+            continue
+        import_s, wall, modules, rc = measure(script, args.python)
+        loaded = sorted(m for m in forbidden if m in modules)
+        problems = []
+        if rc != 0:
+            problems.append(f"code retour {rc}")
+        if loaded:
+            problems.append(f"charge {', '.join(loaded)}")
+        if import_s > args.budget:
+            problems.append(f"budget dépassé ({args.budget:.2f} s)")
+        status = "❌" if problems else "✅"
+        detail = f" — {'; '.join(problems)}" if problems else ""
+        print(f"{status} {rel_path:32s} imports {import_s:6.3f} s  total {wall:6.3f} s{detail}")
+        failures += bool(problems)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
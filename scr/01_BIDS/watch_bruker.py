@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Surveillance des dossiers Bruker bruts : ingestion BIDS dès la fin d'une série.
+
+Au lieu de relancer tout ``Pipeline.jl`` (qui re-parcourt S01/S02/S03), ce
+service surveille les dossiers d'entrée (inotify, ou scrutation périodique si
+inotify est indisponible). Une série est considérée terminée quand
+``rawdata.job0``, ``method`` et ``pdata/1/visu_pars`` existent et n'ont plus
+changé depuis ``--settle`` secondes. Seule cette série est alors traitée :
+
+1. sujet / session (mêmes règles que ``build_global_sessions``) ;
+2. RARE : conversion (``Brkraw_RARE.py``), JSON (``Parser_Bruker_file.py``),
+   mise à jour de ``rare_library.tsv`` ;
+3. mise à jour de ``participants.tsv`` ;
+4. extraction cérébrale de la nouvelle RARE (``ants_client.py extract``, via
+   le worker ANTs s'il tourne).
+
+Les autres séquences (MP2RAGE, MESE, FcFLASH, MGE...) sont laissées à
+``Pipeline.jl`` : leur reconstruction est faite en Julia et un JSON écrit ici
+empêcherait sa relance.
+
+Les séries déjà traitées sont notées dans ``<BIDS>/derivatives/watch_state.json``.
+Au premier lancement, les séries déjà présentes sont ignorées (sauf ``--process-existing``).
+
+Exemple ::
+
+    python watch_bruker.py DATA/S01 DATA/S02 DATA/S03 --bids BIDS
+"""
+
+import os
+import re
+import sys
+import csv
+import json
+import time
+import errno
+import ctypes
+import select
+import struct
+import argparse
+import subprocess
+import ctypes.util
+from datetime import datetime
+
+import manifest
+import participants
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCR_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCR_DIR, ".."))
+
+# Fichiers dont la présence (et la stabilité) marque une série terminée
+COMPLETION_FILES = ("rawdata.job0", "method", os.path.join("pdata", "1", "visu_pars"))
+# Fichiers suivis pour la stabilité (s'ils existent)
+STABILITY_FILES = COMPLETION_FILES + (os.path.join("pdata", "1", "2dseq"),)
+
+# --- inotify (linux) ---
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """Surveillance récursive par inotify (via la libc, sans dépendance)."""
+
+    def __init__(self, roots):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.watches = {}
+        for root in roots:
+            self._add_tree(root)
+
+    def _add(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOENT:
+                return
+            raise OSError(err, f"inotify_add_watch {path} : {os.strerror(err)}")
+        self.watches[wd] = path
+
+    def _add_tree(self, root):
+        """Ajoute ``root`` et ses sous-dossiers ; retourne les fichiers déjà présents."""
+        found = []
+        for dirpath, _, filenames in os.walk(root):
+            self._add(dirpath)
+            found.extend(os.path.join(dirpath, f) for f in filenames)
+        return found
+
+    def read(self, timeout):
+        """
+        Attend jusqu'à ``timeout`` secondes et retourne les chemins modifiés.
+        Retourne None si la file du noyau a débordé (il faut tout re-scanner).
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths, offset = [], 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if wd not in self.watches:
+                continue
+            path = os.path.join(self.watches[wd], name)
+            if mask & IN_ISDIR:
+                # Nouveau dossier (ou dossier déplacé d'un bloc) : surveiller son contenu
+                paths.extend(self._add_tree(path))
+            paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+# --- Métadonnées Bruker (mêmes règles que Pipeline.jl) ---
+
+def extract_method_information(method_file):
+    """Date d'acquisition, numéro d'animal (``Mxx``) et nom de méthode d'un fichier ``method``."""
+    date, id_value, method = "", "", ""
+    with open(method_file, "r", errors="replace") as f:
+        for line in f:
+            if not date and re.match(r"^\$\$ \d{4}-\d{2}-\d{2}", line):
+                date = re.search(r"\d{4}-\d{2}-\d{2}", line).group(0)
+            if not id_value:
+                m = re.search(r"M(\d+)", line)
+                if m:
+                    id_value = m.group(1)
+            if not method and "##$Method=<" in line:
+                m = re.search(r"##\$Method=<(?:Bruker:|User:)([^>]+)>", line)
+                method = m.group(1) if m else ""
+            if date and id_value and method:
+                break
+    return date, id_value, method or "Not found"
+
+
+def clean_method(method):
+    method = re.sub(r"^a_|_CS_360$", "", method)
+    return "RARE" if "RARE" in method else method
+
+
+def dossier_num(path):
+    m = re.search(r"/S(\d+)/", path)
+    return int(m.group(1)) if m else 0
+
+
+def scan_series(input_dirs):
+    """Toutes les séries Bruker (dossiers avec ``method`` + ``rawdata.job0``) des dossiers d'entrée."""
+    series = []
+    for root in input_dirs:
+        for dirpath, _, filenames in os.walk(root):
+            if "method" in filenames and "rawdata.job0" in filenames:
+                date, id_value, method = extract_method_information(os.path.join(dirpath, "method"))
+                if date and id_value and method:
+                    series.append({"path": dirpath, "date": date, "id": f"{int(id_value):02d}",
+                                   "method": clean_method(method)})
+    return series
+
+
+def session_number(all_series, id_value, num, date):
+    """Numéro de session global (règles de ``build_global_sessions``)."""
+    sessions = {(dossier_num(s["path"]), s["date"]) for s in all_series
+                if s["id"] == id_value and s["method"] != "FLASH"}
+    dates = {k: sorted({d for dn, d in sessions if dn == k}) for k in (1, 2, 3)}
+    if num == 1:
+        return dates[1].index(date) + 1
+    if num == 2:
+        return 3 + dates[2].index(date)
+    if num == 3:
+        return len(dates[1]) + len(dates[2]) + dates[3].index(date) + 1
+    return 1
+
+
+# --- Étapes ---
+
+def run_step(cmd):
+    print("  $ " + " ".join(cmd))
+    sys.stdout.flush()
+    subprocess.run(cmd, check=True)
+
+
+def update_rare_library(tsv_path, id_session, rare_path):
+    """Ajoute / remplace ``id_session`` dans ``rare_library.tsv`` (colonnes ID_Session, Filepath)."""
+    library = {}
+    if os.path.exists(tsv_path):
+        with open(tsv_path, newline="") as f:
+            library = {row["ID_Session"]: row["Filepath"] for row in csv.DictReader(f, delimiter="\t")}
+    library[id_session] = rare_path
+    tmp_path = tsv_path + f".tmp-{os.getpid()}"
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.writer(f, delimiter="\t")
+        writer.writerow(["ID_Session", "Filepath"])
+        writer.writerows(library.items())
+    os.replace(tmp_path, tsv_path)
+
+
+class BrukerWatcher:
+
+    def __init__(self, input_dirs, bids_dir, rare_library, settle=30.0, interval=10.0,
+                 python_bin=sys.executable, extract=True):
+        self.input_dirs = [os.path.abspath(d) for d in input_dirs]
+        self.bids_dir = os.path.abspath(bids_dir)
+        self.rare_library = rare_library
+        self.settle = settle
+        self.interval = interval
+        self.python_bin = python_bin
+        self.extract = extract
+        self.state_path = os.path.join(self.bids_dir, "derivatives", "watch_state.json")
+        self.state = self._load_state()
+        self.pending = {}  # série -> (signature, instant où elle a été vue pour la première fois ainsi)
+
+    # --- état ---
+
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return {}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = self.state_path + f".tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def _mark(self, series_dir, status, **info):
+        self.state[series_dir] = dict(info, status=status, time=datetime.now().isoformat(timespec="seconds"))
+        self._save_state()
+
+    # --- détection ---
+
+    @staticmethod
+    def series_dir_of(path):
+        """Dossier de série Bruker contenant ``path`` (ou None)."""
+        parts = path.split(os.sep)
+        if "pdata" in parts:
+            return os.sep.join(parts[:parts.index("pdata")])
+        if os.path.basename(path) in ("rawdata.job0", "method", "acqp"):
+            return os.path.dirname(path)
+        if os.path.isdir(path) and os.path.exists(os.path.join(path, "method")):
+            return path
+        return None
+
+    @staticmethod
+    def signature(series_dir):
+        """(taille, mtime) des fichiers de complétion, ou None si la série est incomplète."""
+        if not all(os.path.isfile(os.path.join(series_dir, f)) for f in COMPLETION_FILES):
+            return None
+        sig = []
+        for f in STABILITY_FILES:
+            path = os.path.join(series_dir, f)
+            if os.path.isfile(path):
+                st = os.stat(path)
+                sig.append((f, st.st_size, st.st_mtime_ns))
+        return tuple(sig)
+
+    def full_scan(self):
+        """Toutes les séries présentes ayant un ``rawdata.job0``."""
+        found = []
+        for root in self.input_dirs:
+            for dirpath, _, filenames in os.walk(root):
+                if "rawdata.job0" in filenames:
+                    found.append(dirpath)
+        return found
+
+    def notice(self, series_dir):
+        if series_dir and series_dir not in self.state and series_dir not in self.pending:
+            self.pending[series_dir] = (None, time.time())
+
+    def check_pending(self):
+        """Traite les séries terminées et stables depuis ``settle`` secondes."""
+        now = time.time()
+        for series_dir, (old_sig, since) in list(self.pending.items()):
+            sig = self.signature(series_dir)
+            if sig is None or sig != old_sig:
+                self.pending[series_dir] = (sig, now)
+                continue
+            if now - since >= self.settle:
+                del self.pending[series_dir]
+                try:
+                    self.process_series(series_dir)
+                except Exception as e:
+                    print(f"❌ Échec pour {series_dir} : {e}")
+                    self._mark(series_dir, "failed", error=str(e))
+
+    # --- traitement d'une série ---
+
+    def process_series(self, series_dir):
+        print(f"🆕 Série terminée : {series_dir}")
+        date, id_value, method = extract_method_information(os.path.join(series_dir, "method"))
+        if not (date and id_value):
+            self._mark(series_dir, "skipped", reason="method incomplet")
+            return
+        method = clean_method(method)
+        if method != "RARE":
+            print(f"  ↳ {method} : laissé à Pipeline.jl.")
+            self._mark(series_dir, "skipped", method=method, reason="reconstruction Pipeline.jl")
+            return
+
+        id_value = f"{int(id_value):02d}"
+        session = session_number(scan_series(self.input_dirs), id_value, dossier_num(series_dir), date)
+        subject_name, session_name = f"sub-{id_value}", f"ses-{session}"
+        info = {"sub": subject_name, "ses": session_name, "method": method}
+
+        anat_dir = os.path.join(self.bids_dir, subject_name, session_name, "anat")
+        os.makedirs(anat_dir, exist_ok=True)
+        stem = f"{subject_name}_{session_name}_{method}"
+        if os.path.exists(os.path.join(anat_dir, f"{stem}.json")):
+            print(f"  ↳ {stem} déjà reconstruit, skip.")
+            self._mark(series_dir, "skipped", reason="déjà dans BIDS", **info)
+            return
+
+        try:
+            rare_path = os.path.join(anat_dir, f"{stem}.nii.gz")
+            s_value = f"{int(os.path.basename(series_dir)):03d}"
+            run_step([self.python_bin, os.path.join(SCR_DIR, "02_reco", "Brkraw_RARE.py"),
+                      os.path.dirname(series_dir), s_value, anat_dir, f"{stem}.nii.gz"])
+            run_step([self.python_bin, os.path.join(SCRIPT_DIR, "Parser_Bruker_file.py"),
+                      series_dir, anat_dir, "--mode", "RARE", "--json_name", f"{stem}.json"])
+            update_rare_library(self.rare_library, f"{subject_name}_{session_name}", rare_path)
+            manifest.record([rare_path, os.path.join(anat_dir, f"{stem}.json")], self.bids_dir)
+
+            participants.write_tsv(participants.process_directories(self.input_dirs),
+                                   os.path.join(self.bids_dir, "participants.tsv"))
+            print("  ✔ participants.tsv mis à jour")
+
+            if self.extract:
+                run_step([self.python_bin, os.path.join(SCR_DIR, "03_masks", "ants_client.py"),
+                          "extract", "--root", self.bids_dir, "--input", rare_path])
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            print(f"❌ Échec pour {series_dir} : {e}")
+            self._mark(series_dir, "failed", error=str(e), **info)
+            return
+
+        print(f"✅ {stem} disponible dans BIDS")
+        self._mark(series_dir, "done", **info)
+
+    # --- boucle ---
+
+    def run(self, process_existing=False, use_inotify=True):
+        existing = self.full_scan()
+        if process_existing:
+            for series_dir in existing:
+                self.notice(series_dir)
+        else:
+            baseline = [s for s in existing if s not in self.state]
+            for series_dir in baseline:
+                self.state[series_dir] = {"status": "baseline"}
+            if baseline:
+                self._save_state()
+                print(f"{len(baseline)} série(s) déjà présente(s) ignorée(s) (--process-existing pour les traiter).")
+
+        watcher = None
+        if use_inotify:
+            try:
+                watcher = InotifyWatcher(self.input_dirs)
+                print(f"👀 inotify : {len(watcher.watches)} dossier(s) surveillé(s)")
+            except (OSError, AttributeError) as e:
+                print(f"⚠️  inotify indisponible ({e}), scrutation toutes les {self.interval:g} s.")
+        else:
+            print(f"👀 Scrutation toutes les {self.interval:g} s.")
+
+        try:
+            while True:
+                if watcher is not None:
+                    # Réveil sur événement, ou au plus tard après ``interval`` pour vérifier la stabilité
+                    paths = watcher.read(self.interval if not self.pending else min(self.interval, self.settle / 3))
+                    if paths is None:
+                        paths = self.full_scan()
+                    for path in paths:
+                        self.notice(self.series_dir_of(path))
+                else:
+                    time.sleep(self.interval)
+                    for series_dir in self.full_scan():
+                        self.notice(series_dir)
+                self.check_pending()
+        except KeyboardInterrupt:
+            print("Arrêt de la surveillance.")
+        finally:
+            if watcher is not None:
+                watcher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Surveille les dossiers Bruker et ingère chaque nouvelle série RARE dans BIDS dès qu'elle est terminée."
+    )
+    parser.add_argument("input_dirs", nargs="+", help="Dossiers Bruker bruts (ex: DATA/S01 DATA/S02 DATA/S03)")
+    parser.add_argument("--bids", default=os.path.join(PROJECT_ROOT, "BIDS"), help="Racine BIDS")
+    parser.add_argument("--rare-library", default=os.path.join(SCR_DIR, "rare_library.tsv"),
+                        help="rare_library.tsv à tenir à jour (défaut : scr/rare_library.tsv)")
+    parser.add_argument("--settle", type=float, default=30.0,
+                        help="Durée (s) sans modification avant de considérer une série terminée")
+    parser.add_argument("--interval", type=float, default=10.0, help="Période de scrutation / vérification (s)")
+    parser.add_argument("--poll", action="store_true", help="Forcer la scrutation périodique (sans inotify)")
+    parser.add_argument("--process-existing", action="store_true",
+                        help="Traiter aussi les séries déjà présentes et non encore traitées")
+    parser.add_argument("--no-extract", action="store_true", help="Ne pas lancer l'extraction cérébrale")
+    args = parser.parse_args()
+
+    watcher = BrukerWatcher(args.input_dirs, args.bids, args.rare_library, settle=args.settle,
+                            interval=args.interval, extract=not args.no_extract)
+    watcher.run(process_existing=args.process_existing, use_inotify=not args.poll)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+File de travail par baux (leases) sur le système de fichiers BIDS partagé.
+
+Plusieurs nœuds / processus montant le même ``BIDS`` se répartissent les
+tâches (une tâche = un sujet/session ou une sortie pour une étape) sans doublon.
+
+Baux à générations : un bail est le fichier ``<étape>/<tâche>.<n>.lease``.
+
+- **prise de bail atomique** : la génération ``n`` est créée par ``os.link``
+  d'un fichier temporaire déjà rempli (atomique, y compris sur NFS ; à défaut
+  ``O_CREAT | O_EXCL``) : un seul processus obtient chaque génération ;
+- **reprise d'un bail expiré** : on crée la génération ``n + 1`` de la même
+  façon ; rien n'est renommé ni écrasé, deux nœuds ne peuvent pas reprendre
+  la même génération ;
+- **propriété** : chaque prise de bail écrit un jeton unique (``uuid4``) dans
+  son fichier ; le détenteur de la génération ``n`` possède la tâche tant que
+  ce fichier contient son jeton et qu'aucune génération supérieure n'existe.
+  Le battement de cœur vérifie ce point avant de rafraîchir la date de *son*
+  fichier (toutes les ``ttl / 4`` s), ``release`` avant de le libérer ;
+  ``Lease.valid()`` fait la même vérification juste avant une écriture (et
+  juste avant le ``os.replace`` des sorties finales, via ``guard``) ;
+- **libération** : le fichier de la génération ``n`` est remplacé par une
+  pierre tombale (``{"released": ...}``) et non supprimé : la génération la plus
+  haute ne redescend jamais, un numéro de génération n'est donc jamais réutilisé ;
+- **expiration** : la génération la plus haute est libre si elle a été libérée,
+  expirée si elle n'a pas été rafraîchie depuis ``ttl`` secondes ou si son
+  processus (sur ce nœud) n'existe plus.
+
+Supprimer le dossier des baux d'une étape n'est sûr que si aucun processus ne
+la traite. Il n'y a pas de marqueur « terminé » : les sorties elles-mêmes, écrites de façon
+atomique (``nifti_writer``, ``mask_store``), en tiennent lieu, et le test
+« la sortie existe » est refait après la prise du bail.
+
+Les baux sont rangés dans ``<BIDS>/derivatives/.leases`` (ou ``$FC3R_LEASE_DIR``).
+Les horloges des nœuds doivent être synchronisées (NTP) à quelques secondes près.
+
+Exemple ::
+
+    queue = WorkQueue(bids_root, "brain_extraction")
+    lease = queue.claim("sub-01_ses-1")
+    if lease is not None:
+        with lease:
+            ...
+            nifti_writer.save(image, output_path, guard=lease.valid)
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import errno
+import socket
+import argparse
+import threading
+
+# Durée de vie d'un bail sans battement de cœur (secondes)
+DEFAULT_TTL = float(os.environ.get("FC3R_LEASE_TTL", 600))
+
+LEASE_RE = re.compile(r"^(?P<task>.+)\.(?P<gen>\d+)\.lease$")
+
+
+def lease_root(bids_root):
+    return os.environ.get("FC3R_LEASE_DIR") or os.path.join(bids_root, "derivatives", ".leases")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Lease:
+    """Bail détenu sur une tâche ; relâché à la sortie du bloc ``with``."""
+
+    def __init__(self, queue, task, generation, path, token, ttl):
+        self.queue = queue
+        self.task = task
+        self.generation = generation
+        self.path = path
+        self.token = token
+        self.ttl = ttl
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True)
+        self._thread.start()
+
+    def valid(self):
+        """
+        Vrai si le bail est toujours détenu : son fichier contient notre jeton et
+        aucune génération supérieure n'a été créée (bail repris par un autre nœud).
+        À appeler juste avant d'écrire une sortie.
+        """
+        if self.lost:
+            return False
+        if (self.queue.read(self.path).get("token") != self.token
+                or self.queue.highest_generation(self.task) > self.generation):
+            self.lost = True
+            print(f"⚠️  Bail perdu (repris par un autre processus) : {self.path}")
+        return not self.lost
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.ttl / 4):
+            # Ne rafraîchit que son propre fichier, et seulement s'il est encore le détenteur
+            if not self.valid():
+                return
+            try:
+                os.utime(self.path, None)
+            except FileNotFoundError:
+                self.valid()
+                return
+            except OSError:
+                pass
+
+    def release(self):
+        """Remplace le bail par une pierre tombale, seulement s'il est toujours le nôtre."""
+        self._stop.set()
+        self._thread.join()
+        if self.lost or self.queue.read(self.path).get("token") != self.token:
+            return
+        tmp_path = self.queue.tmp_path(self.task)
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"released": time.time(), "token": self.token}, f)
+            # Seul le créateur écrit dans le fichier d'une génération : pas de course avec un autre détenteur
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class WorkQueue:
+    """Baux d'une étape (``stage``) du pipeline pour l'arborescence BIDS ``bids_root``."""
+
+    def __init__(self, bids_root, stage, ttl=DEFAULT_TTL):
+        self.stage = stage
+        self.ttl = ttl
+        self.directory = os.path.join(lease_root(bids_root), stage)
+        os.makedirs(self.directory, exist_ok=True)
+        self.host = socket.gethostname()
+
+    def _path(self, task, generation):
+        return os.path.join(self.directory, f"{task}.{generation}.lease")
+
+    def generations(self, task):
+        """Générations existantes des baux de ``task`` (triées)."""
+        found = []
+        for name in os.listdir(self.directory):
+            m = LEASE_RE.match(name)
+            if m and m.group("task") == task:
+                found.append(int(m.group("gen")))
+        return sorted(found)
+
+    def highest_generation(self, task):
+        generations = self.generations(task)
+        return generations[-1] if generations else 0
+
+    def tmp_path(self, task):
+        return os.path.join(self.directory, f".{task}.tmp-{self.host}-{os.getpid()}-{uuid.uuid4().hex}")
+
+    @staticmethod
+    def read(lease_path):
+        """Contenu JSON du bail (``{}`` s'il est absent ou en cours d'écriture)."""
+        try:
+            with open(lease_path) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return info if isinstance(info, dict) else {}
+
+    def _is_free(self, lease_path):
+        """Vrai si le bail a été libéré, a expiré ou si son processus (sur ce nœud) n'existe plus."""
+        try:
+            age = time.time() - os.stat(lease_path).st_mtime
+        except FileNotFoundError:
+            return True
+        info = self.read(lease_path)
+        if "released" in info or age > self.ttl:
+            return True
+        # Bail illisible (en cours d'écriture, création sans lien dur) : on ne se fie qu'à son âge
+        return info.get("host") == self.host and "pid" in info and not _pid_alive(int(info["pid"]))
+
+    def _create(self, tmp_path, lease_path):
+        """Crée ``lease_path`` s'il n'existe pas (atomique) ; False s'il existe déjà."""
+        try:
+            os.link(tmp_path, lease_path)
+            return True
+        except FileExistsError:
+            return False
+        except OSError as e:
+            # Certains systèmes de fichiers n'ont pas de liens durs : création exclusive,
+            # le contenu suit (un bail illisible est considéré comme détenu tant qu'il est récent)
+            if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP):
+                raise
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f, open(tmp_path) as src:
+            f.write(src.read())
+        return True
+
+    def _cleanup(self, task, below):
+        """Retire les générations inférieures à ``below`` (baux repris ou libérés)."""
+        for generation in self.generations(task):
+            if generation < below:
+                try:
+                    os.remove(self._path(task, generation))
+                except OSError:
+                    pass
+
+    def claim(self, task):
+        """
+        Tente de prendre le bail de ``task``. Retourne un ``Lease`` (à utiliser dans
+        un ``with``) ou None si la tâche est détenue par un autre processus.
+        """
+        token = uuid.uuid4().hex
+        tmp_path = self.tmp_path(task)
+        with open(tmp_path, "w") as f:
+            json.dump({"host": self.host, "pid": os.getpid(), "token": token, "stage": self.stage,
+                       "task": task, "acquired": time.time()}, f)
+        try:
+            current = self.highest_generation(task)
+            if current and not self._is_free(self._path(task, current)):
+                return None
+            if current and "released" not in self.read(self._path(task, current)):
+                print(f"♻️  Bail expiré repris : {self._path(task, current)}")
+            generation = current + 1
+            if not self._create(tmp_path, self._path(task, generation)):
+                # Un autre processus a pris cette génération en même temps
+                return None
+            self._cleanup(task, generation)
+            return Lease(self, task, generation, self._path(task, generation), token, self.ttl)
+        finally:
+            os.remove(tmp_path)
+
+    def status(self):
+        """Baux de l'étape : liste de ``(tâche, génération, état)`` (en cours, expiré, libéré)."""
+        leases = {}
+        for name in sorted(os.listdir(self.directory)):
+            m = LEASE_RE.match(name)
+            if m:
+                task, generation = m.group("task"), int(m.group("gen"))
+                leases[task] = max(leases.get(task, 0), generation)
+        result = []
+        for task, generation in sorted(leases.items()):
+            path = self._path(task, generation)
+            if "released" in self.read(path):
+                state = "libéré"
+            else:
+                state = "expiré" if self._is_free(path) else "en cours"
+            result.append((task, generation, state))
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="État des baux de la file de travail.")
+    parser.add_argument("root", help="Racine BIDS")
+    parser.add_argument("stage", help="Étape (ex: brain_extraction, mask)")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.root, args.stage)
+    leases = queue.status()
+    for task, generation, state in leases:
+        print(f"{task}\tgénération {generation}\t{state}")
+    held = sum(state == "en cours" for _, _, state in leases)
+    print(f"{held} bail(s) en cours sur {len(leases)} tâche(s)")
+
+
+if __name__ == "__main__":
+    main()
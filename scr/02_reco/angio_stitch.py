@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Assemblage des trois slabs FcFLASH en une angiographie unique.
+
+Remplace ``angio.sh`` (mrinfo / bc / mrgrid crop / mrcat / mrconvert) : les
+trois slabs sont lus une seule fois, triés selon leur origine sur l'axe 1
+(lue dans l'affine), les recouvrements sont retirés et la concaténation est
+faite en mémoire. ``angio_final`` est écrit une seule fois, de façon atomique,
+dans le chemin de sortie fourni (aucun fichier temporaire dans le dossier
+courant : plusieurs sessions peuvent être assemblées en parallèle).
+"""
+
+import os
+import sys
+import argparse
+
+import numpy as np
+import nibabel as nib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_BIDS"))
+import manifest  # noqa: E402
+import nifti_writer  # noqa: E402
+
+# Axe d'empilement des slabs (axe 1, comme ``mrgrid crop -axis 1`` / ``mrcat -axis 1``)
+STACK_AXIS = 1
+
+
+def load_slab(path):
+    """Charge un slab dans l'orientation la plus proche de RAS (équivalent ``--strides 1,2,3``)."""
+    return nib.as_closest_canonical(nib.load(path))
+
+
+def overlap_voxels(prev_img, next_img, axis=STACK_AXIS):
+    """
+    Nombre de coupes de ``next_img`` recouvertes par ``prev_img`` sur ``axis``.
+
+    Même calcul que ``angio.sh`` : (origine_prev + taille_prev * pas_prev - origine_next) / pas_prev,
+    tronqué à l'entier (division entière ``bc``).
+    """
+    spacing = float(prev_img.header.get_zooms()[axis])
+    end_prev = float(prev_img.affine[axis, 3]) + spacing * prev_img.shape[axis]
+    overlap = (end_prev - float(next_img.affine[axis, 3])) / spacing
+    return max(int(overlap), 0)
+
+
+def stitch_slabs(slabs, axis=STACK_AXIS):
+    """
+    Trie les slabs par origine, retire les recouvrements et concatène.
+
+    Retourne une ``Nifti1Image`` portant l'en-tête du premier slab (comme ``mrcat``).
+    """
+    slabs = sorted(slabs, key=lambda img: float(img.affine[axis, 3]))
+    first = slabs[0]
+
+    blocks = [np.asanyarray(first.dataobj)]
+    for prev_img, next_img in zip(slabs[:-1], slabs[1:]):
+        n_crop = overlap_voxels(prev_img, next_img, axis)
+        print(f"  ↳ recouvrement : {n_crop} coupe(s) retirée(s) sur l'axe {axis}")
+        crop = (slice(None),) * axis + (slice(n_crop, None),)
+        blocks.append(np.asanyarray(next_img.dataobj)[crop])
+
+    stitched = np.concatenate(blocks, axis=axis)
+
+    header = first.header.copy()
+    header.set_data_dtype(first.get_data_dtype())
+    return nib.Nifti1Image(stitched, first.affine, header)
+
+
+def stitch_angio(slab_paths, output_path):
+    """Assemble les slabs ``slab_paths`` et écrit le résultat dans ``output_path``."""
+    slabs = [load_slab(p) for p in slab_paths]
+    angio = stitch_slabs(slabs)
+    nifti_writer.save(angio, output_path, "final")
+    manifest.record(output_path)
+    print(f"✅ Angio assemblée : {output_path} {angio.shape}")
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assemblage des slabs FcFLASH en une angiographie.")
+    parser.add_argument("slabs", nargs=3, help="Les trois slabs FcFLASH (NIfTI), dans n'importe quel ordre")
+    parser.add_argument("-o", "--output", required=True, help="Chemin de sortie (ex: sub-01_ses-1_angio.nii.gz)")
+    args = parser.parse_args()
+
+    stitch_angio(args.slabs, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Réorientation en mémoire des NIfTI mal orientés (remplace la chaîne MRtrix).
+
+La correction historique (``apply_mrtrix_pipeline`` dans ``Pipeline.jl``) enchaîne :
+
+1. ``mrconvert --axes 1,0,2``
+2. ``mrtransform --flip 1``
+3. ``mrconvert --strides 1,2,3``
+4. ``mrtransform --replace <RARE>``
+
+chaque commande décompressant puis recompressant tout le volume. Ici, les quatre
+étapes sont composées en vues NumPy (transpositions / inversions sans copie) et
+en une seule matrice affine ; le volume est matérialisé et compressé une seule
+fois, puis écrit de façon atomique par ``nifti_writer``.
+"""
+
+import os
+import sys
+import csv
+import re
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import nibabel as nib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_BIDS"))
+import manifest  # noqa: E402
+import nifti_writer  # noqa: E402
+
+
+def reorient_array(data, affine, axes=(1, 0, 2), flip=(1,), ref_affine=None):
+    """
+    Compose permutation d'axes, inversion, normalisation des strides et
+    remplacement d'en-tête en une seule opération.
+
+    Paramètres
+    ----------
+    data : numpy.ndarray
+        Volume (3D ou plus, les axes au-delà du 3e sont conservés).
+    affine : numpy.ndarray
+        Matrice 4x4 voxel -> scanner de l'image d'entrée.
+    axes : tuple of int
+        Permutation des trois premiers axes (``mrconvert --axes``).
+    flip : tuple of int
+        Axes à inverser autour du centre de l'image (``mrtransform --flip``).
+    ref_affine : numpy.ndarray ou None
+        Si fourni, remplace la transformation finale (``mrtransform --replace``).
+
+    Retourne
+    --------
+    (data, affine) : ``data`` est une copie contiguë unique (strides 1,2,3).
+    """
+    data = np.asanyarray(data)
+    affine = np.asarray(affine, dtype=float)
+
+    # 1. Permutation des axes (vue, les colonnes de l'affine suivent les axes)
+    axes = list(axes)
+    data = data.transpose(axes + list(range(3, data.ndim)))
+    affine = affine[:, axes + [3]]
+
+    # 2. Inversion autour du centre (vue) : l'image est retournée, l'en-tête ne bouge pas
+    for ax in flip:
+        data = np.flip(data, axis=ax)
+
+    # 3. Strides 1,2,3 : une seule copie, dans l'ordre de stockage NIfTI
+    data = np.asfortranarray(data)
+
+    # 4. Remplacement de l'en-tête par celui de la référence
+    if ref_affine is not None:
+        affine = np.asarray(ref_affine, dtype=float)
+
+    return data, affine
+
+
+def reorient_file(input_path, output_path=None, ref_path=None, axes=(1, 0, 2), flip=(1,)):
+    """
+    Réoriente un fichier NIfTI en une passe (une lecture, une compression).
+
+    Si ``output_path`` est None, l'original est remplacé atomiquement : en cas
+    d'erreur il reste intact (plus besoin de copie ``.bak``).
+    """
+    output_path = output_path or input_path
+    img = nib.load(input_path)
+
+    ref_affine = None
+    ref_img = None
+    if ref_path is not None:
+        ref_img = nib.load(ref_path)
+        ref_affine = ref_img.affine
+
+    data, affine = reorient_array(img.dataobj, img.affine, axes=axes, flip=flip, ref_affine=ref_affine)
+
+    if ref_img is not None and data.shape[:3] != ref_img.shape[:3]:
+        print(f"⚠️  Dimensions {data.shape[:3]} différentes de la référence {ref_img.shape[:3]} : {input_path}")
+
+    header = img.header.copy()
+    out = nib.Nifti1Image(data, affine, header)
+    if ref_img is not None:
+        out.set_qform(affine, int(ref_img.header["qform_code"]) or 1)
+        out.set_sform(affine, int(ref_img.header["sform_code"]) or 1)
+    else:
+        out.set_qform(affine, int(header["qform_code"]) or 1)
+        out.set_sform(affine, int(header["sform_code"]) or 1)
+
+    nifti_writer.save(out, output_path, "final")
+    manifest.record(output_path)
+    return output_path
+
+
+def load_rare_library(tsv_path):
+    """Charge ``rare_library.tsv`` (colonnes ID_Session, Filepath) écrit par ``Pipeline.jl``."""
+    library = {}
+    with open(tsv_path, newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            library[row["ID_Session"]] = row["Filepath"]
+    return library
+
+
+def find_reference(file_path, rare_library):
+    """Retourne la RARE de référence associée à ``sub-XX_ses-YY`` dans le nom du fichier."""
+    m = re.search(r"(sub-[^_]+)_(ses-[^_]+)", os.path.basename(file_path))
+    if m is None:
+        return None
+    return rare_library.get(f"{m.group(1)}_{m.group(2)}")
+
+
+def _tmp_output(path):
+    """Nom « .sub-XX_ses-YY_MOD_tmp.nii.gz » utilisé par ``Reorient_if_bug.sh``."""
+    base = os.path.basename(path)
+    stem = base[:-7] if base.endswith(".nii.gz") else os.path.splitext(base)[0]
+    return os.path.join(os.path.dirname(path), f".{stem}_tmp.nii.gz")
+
+
+def _run_job(job):
+    input_path, output_path, ref_path, axes, flip = job
+    return reorient_file(input_path, output_path, ref_path, axes=axes, flip=flip)
+
+
+def reorient_files(files, rare_library=None, axes=(1, 0, 2), flip=(1,), keep_original=False, jobs=None):
+    """
+    Traite en parallèle une liste de fichiers signalés.
+
+    Les fichiers sans référence RARE sont ignorés lorsque ``rare_library`` est
+    fourni (même comportement que ``fix_bids_nifti_modified``).
+
+    Retourne ``(fichiers écrits, échecs)`` ; ``échecs`` : liste de ``(chemin, erreur)``.
+    Un fichier en échec est laissé intact (écriture atomique).
+    """
+    tasks = []
+    for path in files:
+        ref_path = None
+        if rare_library is not None:
+            ref_path = find_reference(path, rare_library)
+            if ref_path is None:
+                print(f"❌ Pas de RARE de référence pour : {path} – ignoré.")
+                continue
+        output_path = _tmp_output(path) if keep_original else path
+        tasks.append((path, output_path, ref_path, tuple(axes), tuple(flip)))
+
+    done, failed = [], []
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_run_job, t): t[0] for t in tasks}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                out = future.result()
+                print(f"✅ Réorienté : {out}")
+                done.append(out)
+            except Exception as e:
+                print(f"❌ Erreur lors de la réorientation de {path} : {e}")
+                failed.append((path, e))
+    return done, failed
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip() != ""]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Réorientation en une passe (axes, flip, strides, en-tête RARE) d'une liste de NIfTI."
+    )
+    parser.add_argument("files", nargs="+", help="Fichiers NIfTI à corriger")
+    parser.add_argument("--rare-library", default=None,
+                        help="TSV ID_Session -> RARE (rare_library.tsv) pour remplacer l'en-tête")
+    parser.add_argument("--axes", type=_int_list, default=[1, 0, 2], help="Permutation des axes (défaut 1,0,2)")
+    parser.add_argument("--flip", type=_int_list, default=[1], help="Axes à inverser (défaut 1, vide pour aucun)")
+    parser.add_argument("--keep-original", action="store_true",
+                        help="Écrit .<nom>_tmp.nii.gz au lieu de remplacer le fichier")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Nombre de processus (défaut : tous les cœurs)")
+    args = parser.parse_args()
+
+    rare_library = load_rare_library(args.rare_library) if args.rare_library else None
+    _, failed = reorient_files(args.files, rare_library, axes=args.axes, flip=args.flip,
+                               keep_original=args.keep_original, jobs=args.jobs)
+    if failed:
+        print(f"❌ {len(failed)} fichier(s) non réorienté(s) (laissés inchangés) :")
+        for path, e in failed:
+            print(f"  - {path} : {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Cartographie T2* vectorisée (remplace la boucle voxel par voxel de ``T2_star_FC3R``).
+
+Même modèle mono-exponentiel avec plancher de bruit que ``Pipeline.jl`` :
+
+    S(t) = sqrt((a * exp(-t / T2*))^2 + 8 * sigma^2)
+
+mais ajusté sur tous les voxels du masque à la fois :
+
+- initialisation log-linéaire vectorisée (a, T2*) et sigma = bruit des coins ;
+- Levenberg–Marquardt par lots (systèmes 3x3 résolus en bloc avec NumPy) ;
+- voxels découpés en blocs répartis sur les cœurs.
+
+Définitions conservées : T2* = 0 hors masque, si l'ajustement échoue ou si
+R² < 0 ; R² = score de détermination de la courbe ajustée (carte écrite
+jusqu'ici sous le nom ``_R2starmap``). R2* = 1000 / T2* (s⁻¹, TE en ms).
+
+En-tête des sorties : les cartes reçoivent l'affine du masque RARE (donc la
+géométrie de la série), alors que l'ancien ``niwrite(NIVolume(...))`` n'écrivait
+aucune affine (voxels de 1 mm, matrice identité). ``propagate.py`` recopie de
+toute façon l'en-tête de la RARE sur les cartes T2* avant l'alignement.
+"""
+
+import os
+import sys
+import re
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import nibabel as nib
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "..", "01_BIDS"))
+
+from Parser_Bruker_file import parse_bruker_file  # noqa: E402
+import manifest  # noqa: E402
+import nifti_writer  # noqa: E402
+import mask_store  # noqa: E402
+
+WORD_TYPES = {
+    "_8BIT_UNSGN_INT": "u1",
+    "_16BIT_SGN_INT": "i2",
+    "_32BIT_SGN_INT": "i4",
+    "_32BIT_FLOAT": "f4",
+}
+
+# Paramètres Levenberg–Marquardt (mêmes valeurs par défaut que LsqFit.jl, dont maxIter = 1000)
+LM_MAX_ITER = 1000
+LM_LAMBDA = 10.0
+LM_LAMBDA_INCREASE = 10.0
+LM_LAMBDA_DECREASE = 0.1
+LM_MIN_DIAGONAL = 1e-6
+LM_MAX_DIAGONAL = 1e32
+LM_X_TOL = 1e-8
+LM_G_TOL = 1e-12
+
+CHUNK_SIZE = 20000
+
+
+def _expand(value, n):
+    """Développe une valeur Bruker (scalaire, liste ou notation ``@n*(v)``) en ``n`` flottants."""
+    if isinstance(value, str):
+        m = re.match(r"@(\d+)\*\(([^)]+)\)", value.strip())
+        if m:
+            return np.full(int(m.group(1)), float(m.group(2)))[:n]
+        return np.full(n, float(value))
+    return np.broadcast_to(np.atleast_1d(np.asarray(value, dtype=float)), (n,))
+
+
+def read_mge_echoes(bruker_path):
+    """
+    Lit ``pdata/1/2dseq`` d'une série MGE et retourne un tableau (x, y, z, echo).
+
+    La mise à l'échelle (VisuCoreDataSlope / VisuCoreDataOffs) est appliquée et
+    l'axe y est inversé comme dans ``T2_star_FC3R`` (``reco[:, end:-1:1, :, :]``).
+    """
+    visu = parse_bruker_file(os.path.join(bruker_path, "pdata", "1", "visu_pars"), arrays=True)
+    method = parse_bruker_file(os.path.join(bruker_path, "method"), arrays=True)
+
+    te = np.atleast_1d(np.asarray(method["EffectiveTE"], dtype=float))
+    n_echo = te.size
+
+    size = [int(v) for v in np.atleast_1d(visu["VisuCoreSize"])]
+    frames = int(visu.get("VisuCoreFrameCount", n_echo))
+    dtype = np.dtype(WORD_TYPES[visu.get("VisuCoreWordType", "_16BIT_SGN_INT")])
+    dtype = dtype.newbyteorder("<" if visu.get("VisuCoreByteOrder", "littleEndian") == "littleEndian" else ">")
+
+    raw = np.fromfile(os.path.join(bruker_path, "pdata", "1", "2dseq"), dtype=dtype)
+    raw = raw.reshape(frames, -1).astype(np.float32)
+    raw *= _expand(visu.get("VisuCoreDataSlope", 1.0), frames)[:, None].astype(np.float32)
+    raw += _expand(visu.get("VisuCoreDataOffs", 0.0), frames)[:, None].astype(np.float32)
+
+    if len(size) == 3:
+        # 3D : une trame par écho -> (echo, z, y, x)
+        data = raw.reshape((frames,) + tuple(reversed(size))).transpose(3, 2, 1, 0)
+    else:
+        # 2D multi-coupes : l'écho varie le plus vite -> (coupe, echo, y, x)
+        data = raw.reshape((frames // n_echo, n_echo) + tuple(reversed(size))).transpose(3, 2, 0, 1)
+
+    return np.ascontiguousarray(data[:, ::-1, :, :]), te
+
+
+def estimate_noise(echoes):
+    """Écart-type des quatre coins (3 x 21 x 3 voxels) du premier écho, comme dans ``T2_star_FC3R``."""
+    first = echoes[..., 0]
+    corners = [
+        first[:3, 85:106, :3],
+        first[:3, 85:106, -3:],
+        first[-3:, 85:106, :3],
+        first[-3:, 85:106, -3:],
+    ]
+    return float(np.std(np.concatenate([c.ravel() for c in corners]), ddof=1))
+
+
+def model(te, p):
+    """Modèle à plancher de bruit évalué pour un lot de paramètres ``p`` (N, 3) -> (N, E)."""
+    a, t2, sigma = p[:, 0:1], p[:, 1:2], p[:, 2:3]
+    return np.sqrt((a * np.exp(-te / t2)) ** 2 + 8.0 * sigma ** 2)
+
+
+def _jacobian(te, p, f):
+    """Dérivées analytiques du modèle par rapport à (a, T2*, sigma) -> (N, E, 3)."""
+    a, t2, sigma = p[:, 0:1], p[:, 1:2], p[:, 2:3]
+    e2 = np.exp(-2.0 * te / t2)
+    f = np.where(f > 0, f, np.finfo(float).tiny)
+    return np.stack([
+        a * e2 / f,
+        a ** 2 * e2 * te / (t2 ** 2 * f),
+        8.0 * sigma / f,
+    ], axis=-1)
+
+
+def loglinear_init(signal, te, noise):
+    """
+    Initialisation log-linéaire vectorisée : ln S = ln a - t / T2*.
+
+    Si la pente n'est pas décroissante, on retombe sur l'initialisation
+    historique (a = max |S|, T2* = 30, sigma = bruit).
+    """
+    log_s = np.log(np.maximum(signal, np.finfo(float).tiny))
+    t_mean = te.mean()
+    t_c = te - t_mean
+    slope = (log_s - log_s.mean(axis=1, keepdims=True)) @ t_c / (t_c @ t_c)
+    intercept = log_s.mean(axis=1) - slope * t_mean
+
+    p0 = np.empty((signal.shape[0], 3))
+    p0[:, 0] = signal.max(axis=1)
+    p0[:, 1] = 30.0
+    p0[:, 2] = noise
+
+    ok = (slope < 0) & np.isfinite(slope) & np.isfinite(intercept)
+    p0[ok, 0] = np.exp(intercept[ok])
+    p0[ok, 1] = np.clip(-1.0 / slope[ok], 0.1, 1e4)
+    return p0
+
+
+def levenberg_marquardt(signal, te, p0, max_iter=LM_MAX_ITER):
+    """
+    Levenberg–Marquardt par lots sur ``signal`` (N, E) à partir de ``p0`` (N, 3).
+
+    Chaque voxel garde son propre lambda et s'arrête indépendamment (critères
+    x_tol / g_tol de LsqFit) ; les itérations ne portent que sur les voxels actifs.
+    """
+    p = p0.astype(float).copy()
+    lam = np.full(p.shape[0], LM_LAMBDA)
+    f = model(te, p)
+    resid = f - signal
+    cost = np.einsum("ne,ne->n", resid, resid)
+    active = np.ones(p.shape[0], dtype=bool)
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+
+        J = _jacobian(te, p[idx], f[idx])
+        JtJ = np.einsum("nei,nej->nij", J, J)
+        Jtr = np.einsum("nei,ne->ni", J, resid[idx])
+
+        converged = np.abs(Jtr).max(axis=1) < LM_G_TOL
+        diag = np.clip(np.einsum("nii->ni", JtJ), LM_MIN_DIAGONAL, LM_MAX_DIAGONAL)
+        A = JtJ + lam[idx, None, None] * (diag[:, :, None] * np.eye(3))
+        try:
+            delta = -np.linalg.solve(A, Jtr[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            delta = -np.einsum("nij,nj->ni", np.linalg.pinv(A), Jtr)
+
+        p_new = p[idx] + delta
+        f_new = model(te, p_new)
+        resid_new = f_new - signal[idx]
+        cost_new = np.einsum("ne,ne->n", resid_new, resid_new)
+
+        better = np.isfinite(cost_new) & (cost_new < cost[idx])
+        acc = idx[better]
+        p[acc] = p_new[better]
+        f[acc] = f_new[better]
+        resid[acc] = resid_new[better]
+        cost[acc] = cost_new[better]
+        lam[acc] *= LM_LAMBDA_DECREASE
+        lam[idx[~better]] *= LM_LAMBDA_INCREASE
+
+        small_step = np.linalg.norm(delta, axis=1) < LM_X_TOL * (LM_X_TOL + np.linalg.norm(p[idx], axis=1))
+        stuck = lam[idx] > LM_MAX_DIAGONAL
+        active[idx[converged | (better & small_step) | stuck]] = False
+
+    return p, f
+
+
+def r2_score(pred, obs):
+    """R² ligne à ligne (même définition que ``Metrics.r2_score(pred, obs)``)."""
+    ss_res = np.sum((obs - pred) ** 2, axis=1)
+    ss_tot = np.sum((obs - obs.mean(axis=1, keepdims=True)) ** 2, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 1.0 - ss_res / ss_tot
+
+
+def fit_chunk(signal, te, noise, max_iter=LM_MAX_ITER):
+    """Ajuste un bloc de voxels ; retourne (T2*, R²) pour chaque voxel."""
+    signal = np.abs(np.asarray(signal, dtype=float))
+    p0 = loglinear_init(signal, te, noise)
+    p, f = levenberg_marquardt(signal, te, p0, max_iter=max_iter)
+
+    r2 = r2_score(f, signal)
+    t2 = np.where(r2 < 0, 0.0, p[:, 1])
+
+    failed = ~np.isfinite(p).all(axis=1) | ~np.isfinite(r2)
+    t2[failed] = 0.0
+    r2[failed] = 0.0
+    return t2, r2
+
+
+def _fit_chunk_job(args):
+    return fit_chunk(*args)
+
+
+def fit_t2star(echoes, te, mask, noise=None, jobs=None, chunk_size=CHUNK_SIZE, max_iter=LM_MAX_ITER):
+    """
+    Ajuste le modèle sur tous les voxels où ``mask == 1``.
+
+    ``mask`` est un volume ou un ``mask_store.CompactMask`` (liste des voxels du cerveau).
+    Retourne (T2*, R2*, R²), tableaux de la taille spatiale de ``echoes``.
+    """
+    te = np.asarray(te, dtype=float)
+    if noise is None:
+        noise = estimate_noise(echoes)
+
+    if isinstance(mask, mask_store.CompactMask):
+        inside = mask.coords()
+    else:
+        inside = np.nonzero(np.asarray(mask) == 1)
+    signal = echoes[inside][:, :te.size]
+
+    chunks = [signal[i:i + chunk_size] for i in range(0, signal.shape[0], chunk_size)]
+    tasks = [(c, te, noise, max_iter) for c in chunks]
+
+    if jobs == 1 or len(tasks) <= 1:
+        results = [_fit_chunk_job(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_fit_chunk_job, tasks))
+
+    shape = echoes.shape[:3]
+    t2star_map = np.zeros(shape)
+    rsq_map = np.zeros(shape)
+    if results:
+        t2star_map[inside] = np.concatenate([r[0] for r in results])
+        rsq_map[inside] = np.concatenate([r[1] for r in results])
+
+    with np.errstate(divide="ignore"):
+        r2star_map = np.where(t2star_map > 0, 1000.0 / t2star_map, 0.0)
+
+    return t2star_map, r2star_map, rsq_map
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cartographie T2* vectorisée d'une série MGE Bruker.")
+    parser.add_argument("mge_path", help="Dossier Bruker de la série MGE")
+    parser.add_argument("--mask", required=True, help="Masque RARE (voxels traités : mask == 1)")
+    parser.add_argument("--out-t2", required=True, help="Carte T2* (ex: ..._T2starmap.nii.gz)")
+    parser.add_argument("--out-r2", required=True, help="Carte R² de l'ajustement (ex: ..._R2starmap.nii.gz)")
+    parser.add_argument("--out-r2star", default=None, help="Carte R2* = 1000 / T2* (optionnelle)")
+    parser.add_argument("--out-masked", default=None,
+                        help="Copie de la carte T2* dans derivatives/Brain_extracted/T2starmap (optionnelle)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Nombre de processus (défaut : tous les cœurs)")
+    args = parser.parse_args()
+
+    echoes, te = read_mge_echoes(args.mge_path)
+    # En-tête seul (pas de décompression) ; voxels depuis le stockage compact s'il existe
+    mask_img = nib.load(args.mask)
+    mask = mask_store.load_for(args.mask)
+    if mask is None or mask.shape != echoes.shape[:3]:
+        mask = np.asanyarray(mask_img.dataobj)
+
+    n_voxels = len(mask) if isinstance(mask, mask_store.CompactMask) else int((mask == 1).sum())
+    print(f"Ajustement T2* : {n_voxels} voxels, {te.size} échos")
+    t2star_map, r2star_map, rsq_map = fit_t2star(echoes, te, mask, jobs=args.jobs)
+
+    outputs = [(t2star_map, args.out_t2), (rsq_map, args.out_r2)]
+    if args.out_r2star:
+        outputs.append((r2star_map, args.out_r2star))
+    if args.out_masked:
+        # Carte déjà nulle hors masque : même contenu que --out-t2, enregistrée au manifeste
+        outputs.append((t2star_map, args.out_masked))
+    for data, path in outputs:
+        nifti_writer.save(nib.Nifti1Image(data.astype(np.float32), mask_img.affine), path, "final")
+        print(f"💾 Sauvegardé : {path}")
+    manifest.record([path for _, path in outputs])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 import os
+import sys
 import glob
-import ants
+import argparse
+import numpy as np
 
 
 # ---------------------------------------------------------------------
@@ -13,38 +15,48 @@ SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 # then repo root is 2 levels up: 03_masks -> scr -> repo
 PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".."))
 
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "..", "01_BIDS"))
+import manifest  # noqa: E402
+import nifti_writer  # noqa: E402
+import mask_store  # noqa: E402
+
 BIDS_DIR = os.path.join(PROJECT_ROOT, "BIDS")
 DERIV_DIR = os.path.join(BIDS_DIR, "derivatives")
 
 # Output directory
 OUTPUT_DIR = os.path.join(DERIV_DIR, "Brain_extracted", "angio")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# Masks are stored in derivatives/<sub>/<ses>/anat/*_RARE_mask_final.nii.gz
-mask_paths = glob.glob(os.path.join(DERIV_DIR, "sub-*", "ses-*", "anat", "*_RARE_mask_final.nii.gz"))
 
-print(f"🔍 {len(mask_paths)} masques trouvés dans: {DERIV_DIR}")
+def find_masks():
+    # Masks are stored in derivatives/<sub>/<ses>/anat/*_RARE_mask_final.nii.gz
+    if manifest.exists(BIDS_DIR):
+        return manifest.query(BIDS_DIR, stage="masks", modality="RARE", desc="mask_final", ext=".nii.gz")
+    return glob.glob(os.path.join(DERIV_DIR, "sub-*", "ses-*", "anat", "*_RARE_mask_final.nii.gz"))
+
 
-for mask_path in mask_paths:
-    try:
-        base = os.path.basename(mask_path)
-        parts = base.split("_")
-        if len(parts) < 2:
-            print(f"❗ Nom de masque inattendu (skip): {base}")
-            continue
+def is_up_to_date(output_file, *inputs):
+    """Vrai si ``output_file`` existe et n'est pas plus ancien que ses entrées."""
+    if not os.path.exists(output_file):
+        return False
+    return os.path.getmtime(output_file) >= max(os.path.getmtime(p) for p in inputs)
 
-        sub_id = parts[0]  # sub-XX
-        ses_id = parts[1]  # ses-YY
 
-        angio_path = os.path.join(BIDS_DIR, sub_id, ses_id, "anat", f"{sub_id}_{ses_id}_angio.nii.gz")
-        if not os.path.exists(angio_path):
-            print(f"❌ Angio non trouvée : {angio_path}")
-            continue
+def mask_angio(mask_path, angio_path, output_file):
+    """Rééchantillonne l'angio dans l'espace du masque, applique le masque et sauvegarde."""
+    # Importé seulement s'il y a une angio à traiter
+    import ants
 
-        print(f"✅ Traitement de {sub_id} {ses_id}")
+    angio = ants.image_read(angio_path)
+    compact_mask = mask_store.load_for(mask_path)
 
+    if compact_mask is not None:
+        # Grille du masque reconstruite depuis le stockage compact (pas de décompression du NIfTI)
+        geometry = compact_mask.itk_geometry()
+        target = ants.from_numpy(np.zeros(compact_mask.shape, dtype=np.float32), **geometry)
+        angio_resampled = ants.resample_image_to_target(angio, target, interp_type="linear")
+        angio_masked = angio_resampled.new_image_like(compact_mask.apply(angio_resampled.numpy()))
+    else:
         mask = ants.image_read(mask_path)
-        angio = ants.image_read(angio_path)
 
         # Resample angio into mask space
         angio_resampled = ants.resample_image_to_target(angio, mask, interp_type="linear")
@@ -53,10 +65,51 @@ for mask_path in mask_paths:
         mask_bin = mask > 0.5
         angio_masked = angio_resampled * mask_bin
 
-        output_file = os.path.join(OUTPUT_DIR, f"{sub_id}_{ses_id}_angio_masked.nii.gz")
-        angio_masked.to_filename(output_file)
+    nifti_writer.save(angio_masked, output_file, "final")
+    manifest.record(output_file, BIDS_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Applique les masques cérébraux RARE aux angiographies (derivatives/Brain_extracted/angio)."
+    )
+    parser.add_argument("--overwrite", action="store_true",
+                        help="Recalcule les angios masquées déjà à jour")
+    args = parser.parse_args()
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    mask_paths = find_masks()
+    print(f"🔍 {len(mask_paths)} masques trouvés dans: {DERIV_DIR}")
+
+    for mask_path in mask_paths:
+        try:
+            base = os.path.basename(mask_path)
+            parts = base.split("_")
+            if len(parts) < 2:
+                print(f"❗ Nom de masque inattendu (skip): {base}")
+                continue
+
+            sub_id = parts[0]  # sub-XX
+            ses_id = parts[1]  # ses-YY
+
+            angio_path = os.path.join(BIDS_DIR, sub_id, ses_id, "anat", f"{sub_id}_{ses_id}_angio.nii.gz")
+            if not os.path.exists(angio_path):
+                print(f"❌ Angio non trouvée : {angio_path}")
+                continue
+
+            output_file = os.path.join(OUTPUT_DIR, f"{sub_id}_{ses_id}_angio_masked.nii.gz")
+            if not args.overwrite and is_up_to_date(output_file, mask_path, angio_path):
+                print(f"⏩ {os.path.basename(output_file)} déjà à jour, skip.")
+                continue
+
+            print(f"✅ Traitement de {sub_id} {ses_id}")
+            mask_angio(mask_path, angio_path, output_file)
+            print(f"💾 Sauvegardé : {output_file}")
+
+        except Exception as e:
+            print(f"❗ Erreur pour {mask_path} : {e}")
 
-        print(f"💾 Sauvegardé : {output_file}")
 
-    except Exception as e:
-        print(f"❗ Erreur pour {mask_path} : {e}")
+if __name__ == "__main__":
+    main()
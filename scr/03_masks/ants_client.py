@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Client léger du worker ANTs (``ants_worker.py``).
+
+N'importe ni ``ants`` ni ``antspynet`` : envoie le job au worker via le socket
+Unix et affiche son journal au fil de l'eau. Si aucun worker n'écoute, le job
+est exécuté localement (démarrage à froid, même résultat).
+
+Exemples ::
+
+    python ants_client.py mask --mask M.nii.gz --acq A.nii.gz --output O.nii.gz
+    python ants_client.py extract --root BIDS
+"""
+
+import os
+import sys
+import json
+import socket
+import argparse
+import traceback
+
+
+def default_socket_path():
+    """Même règle que ``ants_worker.default_socket_path`` (sans importer ANTs)."""
+    if os.environ.get("FC3R_ANTS_SOCKET"):
+        return os.environ["FC3R_ANTS_SOCKET"]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(runtime_dir, f"fc3r_ants_worker-{os.getuid()}.sock")
+
+
+class WorkerLost(Exception):
+    """Connexion au worker perdue après l'envoi du job (pas de repli local)."""
+
+
+def send_job(socket_path, job, **params):
+    """
+    Envoie un job au worker, affiche son journal ligne par ligne pendant
+    l'exécution et retourne la réponse finale (dict). Lève ``OSError`` si le
+    worker est absent, ``WorkerLost`` s'il disparaît en cours de job.
+    """
+    request = dict(params, job=job)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        try:
+            sock.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            with sock.makefile("rb") as f:
+                for line in f:
+                    message = json.loads(line.decode("utf-8"))
+                    if "ok" in message:
+                        return message
+                    sys.stdout.write(message.get("log", ""))
+                    sys.stdout.flush()
+        except OSError as e:
+            raise WorkerLost(f"Connexion au worker interrompue : {e}") from e
+    raise WorkerLost("Connexion au worker interrompue avant la fin du job")
+
+
+def run_local(job, **params):
+    """Exécute le job dans ce processus (sans worker)."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from ants_worker import JOBS
+
+    try:
+        return {"ok": True, "result": JOBS[job](**params)}
+    except Exception:
+        return {"ok": False, "error": traceback.format_exc()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client du worker ANTs persistant.")
+    parser.add_argument("--socket", default=default_socket_path(), help="Chemin du socket Unix du worker")
+    parser.add_argument("--no-fallback", action="store_true",
+                        help="Échoue si le worker n'est pas joignable au lieu d'exécuter localement")
+    sub = parser.add_subparsers(dest="job", required=True)
+
+    sub.add_parser("ping", help="Vérifie que le worker répond")
+    sub.add_parser("shutdown", help="Arrête le worker")
+
+    p_mask = sub.add_parser("mask", help="Applique un masque (mask_aaply.py)")
+    p_mask.add_argument("--mask", required=True)
+    p_mask.add_argument("--acq", required=True)
+    p_mask.add_argument("--output", required=True)
+
+    p_extract = sub.add_parser("extract", help="Extraction cérébrale (brain_extraction.py)")
+    p_extract.add_argument("--root", default=None, help="Arborescence BIDS complète")
+    p_extract.add_argument("--input", default=None,
+                           help="Un seul fichier RARE (avec --root : sorties rangées comme pour l'arborescence)")
+    p_extract.add_argument("--output", default=None)
+    p_extract.add_argument("--brain-path", default=None)
+    p_extract.add_argument("--erosion-radius", type=int, default=6)
+    p_extract.add_argument("--batch-size", type=int, default=4, help="Sujets par inférence antspynet (avec --root)")
+
+    args = parser.parse_args()
+    params = {k: v for k, v in vars(args).items() if k not in ("socket", "no_fallback", "job")}
+    if args.job == "extract" and params["root"] is None and params["input"] is None:
+        parser.error("extract : --root ou --input requis")
+
+    try:
+        response = send_job(args.socket, args.job, **params)
+    except OSError:
+        if args.no_fallback or args.job in ("ping", "shutdown"):
+            print(f"❌ Worker ANTs injoignable : {args.socket}")
+            sys.exit(1)
+        print("⚠️  Worker ANTs injoignable, exécution locale.")
+        response = run_local(args.job, **params)
+    except WorkerLost as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if not response.get("ok"):
+        print(f"❌ Erreur du job {args.job} : {response.get('error')}")
+        sys.exit(1)
+    if args.job in ("ping", "shutdown"):
+        print(response.get("result"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Worker ANTs persistant (socket Unix).
+
+Chaque étape Python lancée par ``Pipeline.jl`` paie l'import de ``ants`` (et,
+pour l'extraction, d'``antspynet`` / TensorFlow + le chargement du modèle
+souris), souvent plus long que le travail lui-même. Ce worker garde ces
+bibliothèques et le modèle en mémoire et exécute les jobs envoyés par
+``ants_client.py``.
+
+Protocole : une requête JSON par connexion (une ligne). Pendant le job, chaque
+ligne affichée est renvoyée aussitôt (``{"log": "..."}``, une ligne JSON par
+ligne de journal) ; la dernière ligne est la réponse
+``{"ok": bool, "result": ..., "error": "..."}``.
+
+Jobs disponibles : ``ping``, ``mask``, ``extract``, ``shutdown``.
+"""
+
+import io
+import os
+import sys
+import json
+import argparse
+import threading
+import traceback
+import socketserver
+from contextlib import redirect_stdout
+
+# Importé d'emblée : c'est tout l'intérêt du worker (les scripts, eux, l'importent à la demande)
+import ants  # noqa: F401
+
+import brain_extraction
+import mask_aaply
+
+# Les jobs ANTs / TensorFlow sont exécutés un par un (ITK et TF sont déjà multi-threadés)
+JOB_LOCK = threading.Lock()
+
+
+def default_socket_path():
+    """Chemin du socket : ``$FC3R_ANTS_SOCKET`` sinon ``$XDG_RUNTIME_DIR`` ou ``/tmp``."""
+    if os.environ.get("FC3R_ANTS_SOCKET"):
+        return os.environ["FC3R_ANTS_SOCKET"]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(runtime_dir, f"fc3r_ants_worker-{os.getuid()}.sock")
+
+
+def job_mask(mask, acq, output):
+    """Même traitement que ``mask_aaply.py``."""
+    return mask_aaply.apply_mask(mask, acq, output)
+
+
+def job_extract(root=None, input=None, output=None, brain_path=None, erosion_radius=6,
+                batch_size=brain_extraction.BATCH_SIZE):
+    """
+    Extraction cérébrale : arborescence complète (``root``, par lots), une RARE
+    de l'arborescence (``root`` + ``input``) ou un seul fichier (``input``).
+    """
+    if root is not None:
+        brain_extraction.process_tree(root, batch_size=int(batch_size), files=[input] if input else None)
+        return root
+    return brain_extraction.process_file(input, output, brain_path, erosion_radius=int(erosion_radius))
+
+
+JOBS = {
+    "ping": lambda: "pong",
+    "mask": job_mask,
+    "extract": job_extract,
+}
+
+
+class StreamedLog(io.TextIOBase):
+    """
+    ``stdout`` d'un job : chaque ligne complète est recopiée sur la sortie du
+    worker et renvoyée immédiatement au client (``{"log": ...}``), pour suivre
+    l'avancement d'une longue extraction. Si le client est parti, le job continue.
+    """
+
+    def __init__(self, wfile, echo):
+        self.wfile = wfile
+        self.echo = echo
+        self._pending = ""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self.echo.write(text)
+        self._pending += text
+        *lines, self._pending = self._pending.split("\n")
+        for line in lines:
+            self._send(line + "\n")
+        return len(text)
+
+    def flush(self):
+        if self._pending:
+            self._send(self._pending)
+            self._pending = ""
+        self.echo.flush()
+
+    def _send(self, text):
+        if self.wfile is None:
+            return
+        try:
+            self.wfile.write((json.dumps({"log": text}) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        except (OSError, ValueError):
+            self.wfile = None
+
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        response = {"ok": False}
+        try:
+            request = json.loads(line.decode("utf-8"))
+            job = request.pop("job")
+
+            if job == "shutdown":
+                response = {"ok": True, "result": "bye"}
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            elif job not in JOBS:
+                response["error"] = f"Job inconnu : {job}"
+            else:
+                with JOB_LOCK:
+                    log = StreamedLog(self.wfile, sys.stdout)
+                    with redirect_stdout(log):
+                        try:
+                            result = JOBS[job](**request)
+                            response = {"ok": True, "result": result}
+                        except Exception:
+                            response["error"] = traceback.format_exc()
+                    log.flush()
+        except Exception:
+            response["error"] = traceback.format_exc()
+
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path, preload_model=True):
+    """Démarre le worker sur ``socket_path`` (bloquant jusqu'au job ``shutdown``)."""
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    if preload_model:
+        print("Chargement du modèle antspynet (mouseT2wBrainExtraction3D)...")
+        brain_extraction.get_mouse_model()
+
+    server = WorkerServer(socket_path, WorkerHandler)
+    os.chmod(socket_path, 0o600)
+    print(f"🟢 Worker ANTs prêt : {socket_path}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        print("Worker ANTs arrêté.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker ANTs/antspynet persistant à l'écoute d'un socket Unix.")
+    parser.add_argument("--socket", default=default_socket_path(), help="Chemin du socket Unix")
+    parser.add_argument("--no-preload", action="store_true", help="Ne pas charger le modèle antspynet au démarrage")
+    args = parser.parse_args()
+
+    serve(args.socket, preload_model=not args.no_preload)
+
+
+if __name__ == "__main__":
+    main()
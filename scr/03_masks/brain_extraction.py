@@ -2,24 +2,138 @@
 #!/usr/bin/env python3
 
 import os
+import sys
+import glob
 import argparse
-import ants
-import antspynet
+import numpy as np
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_BIDS"))
+import manifest  # noqa: E402
+import nifti_writer  # noqa: E402
+import mask_store  # noqa: E402
+import work_queue  # noqa: E402
 
-def process_file(input_path, output_path, Brain_PATH, erosion_radius=6):
+# Grille du template T2w souris utilisée par antspynet.mouse_brain_extraction
+TEMPLATE_SHAPE = (176, 176, 176)
+
+# Nombre de sujets passés ensemble dans le U-Net
+BATCH_SIZE = 4
+
+# Modèle U-Net et masque du template, chargés une seule fois par processus
+_MOUSE_MODEL = {}
+
+# ``ants`` et ``antspynet`` (TensorFlow) sont importés dans les fonctions qui en ont
+# besoin : ``--help``, les sujets exclus et les masques déjà présents n'en paient pas le coût.
+
+
+def get_mouse_model():
     """
-    Pipeline amélioré :
-    - Double correction N4 (2 passes consécutives)
-    - Extraction probabiliste du cerveau (antspynet)
-    - Seuillage adaptatif (Otsu)
-    - Morphologie : érosion + plus grande composante + dilatation (même rayon) + FillHoles
+    Charge (une seule fois) le U-Net ``mouseT2wBrainExtraction3D`` et le masque
+    du template T2w, exactement comme ``antspynet.mouse_brain_extraction``.
+    """
+    if not _MOUSE_MODEL:
+        import ants
+        from antspynet.architectures import create_unet_model_3d
+        from antspynet.utilities import get_pretrained_network, get_antsxnet_data
+
+        template_mask = ants.image_read(get_antsxnet_data("bsplineT2MouseTemplateBrainMask"))
+        template_mask = ants.resample_image(template_mask, TEMPLATE_SHAPE, use_voxels=True, interp_type=1)
+
+        unet_model = create_unet_model_3d((*TEMPLATE_SHAPE, 1),
+                                          number_of_outputs=1, mode="sigmoid",
+                                          number_of_filters=(16, 32, 64, 128),
+                                          convolution_kernel_size=(3, 3, 3),
+                                          deconvolution_kernel_size=(2, 2, 2))
+        unet_model.load_weights(get_pretrained_network("mouseT2wBrainExtraction3D"))
+
+        _MOUSE_MODEL["unet"] = unet_model
+        _MOUSE_MODEL["template_mask"] = template_mask
+    return _MOUSE_MODEL["unet"], _MOUSE_MODEL["template_mask"]
+
+
+def to_template_space(image, template_mask):
+    """
+    Prétraitement interne d'``antspynet.mouse_brain_extraction`` : translation
+    des centres de masse vers le template puis normalisation min-max.
+
+    Retourne l'image dans la grille du template et la transformation inverse.
+    """
+    import ants
+
+    center_of_mass_reference = ants.get_center_of_mass(template_mask)
+    center_of_mass_image = ants.get_center_of_mass(image)
+    translation = np.asarray(center_of_mass_image) - np.asarray(center_of_mass_reference)
+    xfrm = ants.create_ants_transform(transform_type="Euler3DTransform",
+                                      center=np.asarray(center_of_mass_reference), translation=translation)
+    xfrm_inv = ants.invert_ants_transform(xfrm)
+
+    image_warped = ants.apply_ants_transform_to_image(xfrm, image, template_mask, interpolation="linear")
+    image_warped = (image_warped - image_warped.min()) / (image_warped.max() - image_warped.min())
+    return image_warped, xfrm_inv
+
+
+def from_template_space(probability, image_warped, xfrm_inv, image):
+    """Ramène une carte de probabilité (grille du template) dans l'espace de ``image``."""
+    import ants
+
+    probability_mask = ants.from_numpy(probability, origin=image_warped.origin,
+                                       spacing=image_warped.spacing, direction=image_warped.direction)
+    return ants.apply_ants_transform_to_image(xfrm_inv, probability_mask, image, interpolation="linear")
+
+
+def mouse_brain_extraction_batch(images, batch_size=BATCH_SIZE):
+    """
+    Extraction probabiliste sur plusieurs images en une seule inférence.
+
+    Chaque image reçoit le même prétraitement que dans ``antspynet`` ; les
+    volumes sont empilés dans un lot ``(n, 176, 176, 176, 1)`` passé au U-Net
+    (par paquets de ``batch_size``), puis chaque carte est ramenée dans
+    l'espace de son image. Retourne une carte de probabilité par image.
     """
-    base_name = os.path.basename(input_path)
+    unet_model, template_mask = get_mouse_model()
+
+    warped = [to_template_space(image, template_mask) for image in images]
+
+    batchX = np.zeros((len(images), *TEMPLATE_SHAPE, 1))
+    for i, (image_warped, _) in enumerate(warped):
+        batchX[i, :, :, :, 0] = image_warped.numpy()
+    batchY = unet_model.predict(batchX, batch_size=batch_size, verbose=False)[..., 0]
+
+    return [from_template_space(batchY[i], image_warped, xfrm_inv, image)
+            for i, ((image_warped, xfrm_inv), image) in enumerate(zip(warped, images))]
+
+
+def mouse_brain_extraction(image):
+    """
+    Équivalent de ``antspynet.mouse_brain_extraction(image)`` (modalité t2) avec
+    un modèle gardé en mémoire entre deux appels (utile pour le worker ANTs).
+    """
+    return mouse_brain_extraction_batch([image], batch_size=1)[0]
+
+
+def strip_nii(path):
+    base_name = os.path.basename(path)
     if base_name.endswith(".nii.gz"):
-        base_name = base_name[:-7]
-    elif base_name.endswith(".nii"):
-        base_name = base_name[:-4]
+        return base_name[:-7]
+    if base_name.endswith(".nii"):
+        return base_name[:-4]
+    return base_name
+
+
+def final_mask_path(input_path, output_path):
+    """Chemin du masque final écrit par ``postprocess_file``."""
+    return os.path.join(os.path.dirname(output_path), f"{strip_nii(input_path)}_mask_final.nii.gz")
+
+
+def preprocess_file(input_path, output_path):
+    """
+    Étapes 0 à 2 : lecture et double correction N4.
+
+    Retourne l'état transmis à ``postprocess_file`` (image corrigée, noms et dossiers).
+    """
+    import ants
+
+    base_name = strip_nii(input_path)
 
     print(f"Lecture de l'image : {input_path}")
     image = ants.image_read(input_path)
@@ -31,7 +145,7 @@ def process_file(input_path, output_path, Brain_PATH, erosion_radius=6):
     step_counter = 1
 
     # 0. Sauvegarde de l'image brute
-    ants.image_write(image, os.path.join(step_dir, f"{base_name}_step{step_counter}_input.nii.gz"))
+    nifti_writer.save(image, os.path.join(step_dir, f"{base_name}_step{step_counter}_input.nii.gz"), "intermediate")
     step_counter += 1
 
     # 1. Correction N4 (première passe)
@@ -41,7 +155,7 @@ def process_file(input_path, output_path, Brain_PATH, erosion_radius=6):
         shrink_factor=4,
         convergence={"iters": [20, 20, 10], "tol": 1e-6},
     )
-    ants.image_write(image, os.path.join(step_dir, f"{base_name}_step{step_counter}_n4_pass1.nii.gz"))
+    nifti_writer.save(image, os.path.join(step_dir, f"{base_name}_step{step_counter}_n4_pass1.nii.gz"), "intermediate")
     step_counter += 1
 
     # 2. Correction N4 (deuxième passe)
@@ -51,69 +165,215 @@ def process_file(input_path, output_path, Brain_PATH, erosion_radius=6):
         shrink_factor=2,
         convergence={"iters": [30, 20, 10], "tol": 1e-6},
     )
-    ants.image_write(image, os.path.join(step_dir, f"{base_name}_step{step_counter}_n4_pass2.nii.gz"))
+    nifti_writer.save(image, os.path.join(step_dir, f"{base_name}_step{step_counter}_n4_pass2.nii.gz"), "intermediate")
     step_counter += 1
 
+    return {
+        "image": image,
+        "base_name": base_name,
+        "output_dir": output_dir,
+        "step_dir": step_dir,
+        "step_counter": step_counter,
+    }
+
+
+def postprocess_file(state, proba_image, Brain_PATH, erosion_radius=6, lease=None):
+    """
+    Étapes 3 à 9 à partir de la carte de probabilité : seuillage Otsu,
+    morphologie, application du masque et écriture des sorties.
+
+    ``lease`` : bail du sujet (``work_queue``) ; si un autre processus l'a repris,
+    les sorties finales ne sont pas écrites (vérification juste avant chaque
+    ``os.replace``) et la fonction retourne None.
+    """
+    import ants
+
+    image = state["image"]
+    base_name = state["base_name"]
+    output_dir = state["output_dir"]
+    step_dir = state["step_dir"]
+    step_counter = state["step_counter"]
+
     # 3. Extraction cerveau (probabilité)
-    print("Extraction du cerveau (antspynet)...")
-    proba_image = antspynet.mouse_brain_extraction(image)
-    ants.image_write(proba_image, os.path.join(step_dir, f"{base_name}_step{step_counter}_proba.nii.gz"))
+    nifti_writer.save(proba_image, os.path.join(step_dir, f"{base_name}_step{step_counter}_proba.nii.gz"), "intermediate")
     step_counter += 1
 
     # 4. Seuillage adaptatif (Otsu)
     print("Seuillage adaptatif (méthode Otsu)...")
     mask = ants.threshold_image(proba_image, "Otsu", 1, 0)
-    ants.image_write(mask, os.path.join(step_dir, f"{base_name}_step{step_counter}_otsu.nii.gz"))
+    nifti_writer.save(mask, os.path.join(step_dir, f"{base_name}_step{step_counter}_otsu.nii.gz"), "intermediate")
     step_counter += 1
 
     # 5. Morphologie : érosion (rayon variable)
     print(f"Érosion appliquée (rayon={erosion_radius})...")
     mask_eroded = ants.iMath(mask, "ME", erosion_radius)
-    ants.image_write(mask_eroded, os.path.join(step_dir, f"{base_name}_step{step_counter}_eroded.nii.gz"))
+    nifti_writer.save(mask_eroded, os.path.join(step_dir, f"{base_name}_step{step_counter}_eroded.nii.gz"), "intermediate")
     step_counter += 1
 
     # 6. Plus grande composante
     print("Extraction de la plus grande composante...")
     mask_component = ants.iMath(mask_eroded, "GetLargestComponent", 10000)
-    ants.image_write(
-        mask_component, os.path.join(step_dir, f"{base_name}_step{step_counter}_largest_component.nii.gz")
-    )
+    nifti_writer.save(mask_component, os.path.join(step_dir, f"{base_name}_step{step_counter}_largest_component.nii.gz"), "intermediate")
     step_counter += 1
 
     # 7. Dilatation (IMPORTANT : même rayon que l'érosion)
     print(f"Dilatation appliquée (rayon={erosion_radius})...")
     mask_dilated = ants.iMath(mask_component, "MD", erosion_radius)
-    ants.image_write(mask_dilated, os.path.join(step_dir, f"{base_name}_step{step_counter}_dilated.nii.gz"))
+    nifti_writer.save(mask_dilated, os.path.join(step_dir, f"{base_name}_step{step_counter}_dilated.nii.gz"), "intermediate")
     step_counter += 1
 
     # 8. FillHoles
     print("Remplissage des trous...")
     mask_filled = ants.iMath(mask_dilated, "FillHoles", 0.3)
-    ants.image_write(mask_filled, os.path.join(step_dir, f"{base_name}_step{step_counter}_fillholes.nii.gz"))
+    nifti_writer.save(mask_filled, os.path.join(step_dir, f"{base_name}_step{step_counter}_fillholes.nii.gz"), "intermediate")
     step_counter += 1
 
     # 9. Application du mask final
+    if not _owned(lease):
+        return None
+    guard = lease.valid if lease is not None else None
     print("Application du mask final...")
     brain_image = ants.multiply_images(image, mask_filled)
     os.makedirs(Brain_PATH, exist_ok=True)
-    ants.image_write(brain_image, os.path.join(Brain_PATH, f"{base_name}_brain_extracted.nii.gz"))
+    brain_output_path = os.path.join(Brain_PATH, f"{base_name}_brain_extracted.nii.gz")
+    if nifti_writer.save(brain_image, brain_output_path, "final", guard=guard) is None:
+        return None
 
     # Sauvegarde du mask final dans le dossier dérivé correspondant
     final_output_path = os.path.join(output_dir, f"{base_name}_mask_final.nii.gz")
-    ants.image_write(mask_filled, final_output_path)
+    if nifti_writer.save(mask_filled, final_output_path, "final", guard=guard) is None:
+        return None
+    # Version compacte (voxels + boîte englobante) lue par les étapes de masquage et T2*
+    store_output_path = mask_store.publish_ants(mask_filled, final_output_path, guard=guard)
+    if store_output_path is None:
+        return None
     print(f"Résultat final sauvegardé : {final_output_path}")
 
+    manifest.record(
+        sorted(glob.glob(os.path.join(step_dir, f"{base_name}_step*.nii.gz")))
+        + [brain_output_path, final_output_path, store_output_path]
+    )
+
     return final_output_path
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Parcours de l'arborescence pour appliquer l'extraction cérébrale et le post-traitement sur les fichiers RARE.nii.gz."
-    )
-    parser.add_argument("-r", "--root", required=True, help="Chemin racine de l'arborescence à parcourir")
-    args = parser.parse_args()
+def process_file(input_path, output_path, Brain_PATH, erosion_radius=6):
+    """
+    Pipeline amélioré :
+    - Double correction N4 (2 passes consécutives)
+    - Extraction probabiliste du cerveau (antspynet)
+    - Seuillage adaptatif (Otsu)
+    - Morphologie : érosion + plus grande composante + dilatation (même rayon) + FillHoles
+    """
+    state = preprocess_file(input_path, output_path)
+    print("Extraction du cerveau (antspynet)...")
+    proba_image = mouse_brain_extraction(state["image"])
+    return postprocess_file(state, proba_image, Brain_PATH, erosion_radius=erosion_radius)
+
 
-    root_dir = os.path.abspath(args.root)
+def _owned(lease):
+    """Vrai s'il n'y a pas de bail ou si le bail est toujours détenu (à vérifier avant d'écrire)."""
+    return lease is None or lease.valid()
+
+
+def _claim(queue, input_path, output_path):
+    """
+    Prend le bail du sujet dans ``queue`` (None : pas de file). Retourne
+    ``(ok, bail)`` ; ``ok`` est faux si un autre processus traite ce sujet ou
+    si le masque final est apparu entre-temps.
+    """
+    if queue is None:
+        return True, None
+    lease = queue.claim(strip_nii(input_path))
+    if lease is None:
+        print(f"⏩ {os.path.basename(input_path)} est traité par un autre processus, skip.")
+        return False, None
+    if os.path.exists(final_mask_path(input_path, output_path)):
+        lease.release()
+        print(f"Le mask existe déjà pour {strip_nii(input_path)}, passage au fichier suivant.")
+        return False, None
+    return True, lease
+
+
+def process_files_batched(jobs, Brain_PATH, batch_size=BATCH_SIZE, queue=None):
+    """
+    Comme ``process_file`` pour plusieurs fichiers, avec une seule inférence
+    antspynet par lot de ``batch_size`` sujets.
+
+    ``jobs`` : liste de ``(input_path, output_path, erosion_radius)``.
+    ``queue`` : ``work_queue.WorkQueue`` partagée entre nœuds ; chaque sujet
+    n'est traité que par le processus qui a pris son bail.
+    Retourne la liste des masques finaux écrits.
+    """
+    written = []
+    pending = list(jobs)
+    while pending:
+        batch, leases = [], []
+        while pending and len(batch) < batch_size:
+            input_path, output_path, erosion_radius = pending.pop(0)
+            ok, lease = _claim(queue, input_path, output_path)
+            if not ok:
+                continue
+            if lease is not None:
+                leases.append(lease)
+            try:
+                batch.append((input_path, preprocess_file(input_path, output_path), erosion_radius, lease))
+            except Exception as e:
+                print(f"Erreur lors du traitement de {input_path} : {e}")
+
+        try:
+            if not batch:
+                continue
+
+            print(f"Extraction du cerveau (antspynet, lot de {len(batch)} sujet(s))...")
+            try:
+                proba_images = mouse_brain_extraction_batch([state["image"] for _, state, _, _ in batch], batch_size)
+            except Exception as e:
+                print(f"Erreur lors de l'extraction du lot ({', '.join(p for p, _, _, _ in batch)}) : {e}")
+                continue
+
+            for (input_path, state, erosion_radius, lease), proba_image in zip(batch, proba_images):
+                # Bail repris par un autre nœud (processus trop lent) : il refera ce sujet
+                if not _owned(lease):
+                    continue
+                try:
+                    final_path = postprocess_file(state, proba_image, Brain_PATH,
+                                                  erosion_radius=erosion_radius, lease=lease)
+                    if final_path is not None:
+                        written.append(final_path)
+                except Exception as e:
+                    print(f"Erreur lors du traitement de {input_path} : {e}")
+        finally:
+            for lease in leases:
+                lease.release()
+    return written
+
+
+def find_rare_files(root_dir):
+    """
+    Liste les ``*RARE.nii.gz`` de ``root_dir`` hors ``derivatives`` : requête
+    sur le manifeste s'il existe, sinon parcours de l'arborescence.
+    """
+    if manifest.exists(root_dir):
+        return manifest.query(root_dir, stage="raw", modality="RARE", desc="", ext=".nii.gz")
+
+    rare_files = []
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames[:] = [d for d in dirnames if d != "derivatives"]
+        rare_files.extend(os.path.join(dirpath, f) for f in filenames if "RARE.nii.gz" in f)
+    return rare_files
+
+
+def process_tree(root_dir, batch_size=BATCH_SIZE, files=None):
+    """
+    Parcourt ``root_dir`` (hors ``derivatives``) et traite chaque
+    ``*RARE.nii.gz`` dont le masque final n'existe pas encore, par lots de
+    ``batch_size`` sujets pour l'inférence antspynet.
+
+    ``files`` restreint le traitement à ces RARE (ex. nouvelle série détectée
+    par ``watch_bruker.py``), avec les mêmes règles de sortie.
+    """
+    root_dir = os.path.abspath(root_dir)
 
     # Création du dossier 'derivatives' à la racine spécifiée
     derivatives_dir = os.path.join(root_dir, "derivatives")
@@ -126,57 +386,68 @@ def main():
     # Liste des souris à exclure (identifiants présents dans le chemin complet)
     exclude_subjects = ["sub-07_ses-3"]
 
-    # Parcours récursif en excluant 'derivatives'
-    for dirpath, dirnames, filenames in os.walk(root_dir):
-        dirnames[:] = [d for d in dirnames if d != "derivatives"]
+    jobs = []
+    for input_file in (files if files is not None else find_rare_files(root_dir)):
+        input_file = os.path.abspath(input_file)
+        dirpath, filename = os.path.split(input_file)
 
-        for filename in filenames:
-            if "RARE.nii.gz" not in filename:
-                continue
+        if any(excl in input_file for excl in exclude_subjects):
+            print(f"⚠️  Fichier ignoré (exclu par la liste) : {input_file}")
+            continue
 
-            input_file = os.path.join(dirpath, filename)
+        # Conserver la structure relative pour le dossier derivatives
+        rel_path = os.path.relpath(dirpath, root_dir)
+        output_dir = os.path.join(derivatives_dir, rel_path)
+        os.makedirs(output_dir, exist_ok=True)
 
-            if any(excl in input_file for excl in exclude_subjects):
-                print(f"⚠️  Fichier ignoré (exclu par la liste) : {input_file}")
-                continue
+        # Base name sans extension .nii.gz
+        base_name = filename.replace(".nii.gz", "")
 
-            # Conserver la structure relative pour le dossier derivatives
-            rel_path = os.path.relpath(dirpath, root_dir)
-            output_dir = os.path.join(derivatives_dir, rel_path)
-            os.makedirs(output_dir, exist_ok=True)
+        # Vérification de l'existence du masque final
+        mask_final_path = os.path.join(output_dir, f"{base_name}_mask_final.nii.gz")
+        if os.path.exists(mask_final_path):
+            print(f"Le mask existe déjà pour {base_name}, passage au fichier suivant.")
+            continue
 
-            # Base name sans extension .nii.gz
-            base_name = filename.replace(".nii.gz", "")
+        # Fichier brain_extracted dans le dossier dérivé correspondant
+        output_file = os.path.join(output_dir, f"{base_name}_brain_extracted.nii.gz")
 
-            # Vérification de l'existence du masque final
-            mask_final_path = os.path.join(output_dir, f"{base_name}_mask_final.nii.gz")
-            if os.path.exists(mask_final_path):
-                print(f"Le mask existe déjà pour {base_name}, passage au fichier suivant.")
-                continue
+        # --- Choix du rayon d'érosion selon sub/ses ---
+        parts = input_file.split(os.sep)
+        sub_id = next((p for p in parts if p.startswith("sub-")), None)
+        ses_id = next((p for p in parts if p.startswith("ses-")), None)
 
-            # Fichier brain_extracted dans le dossier dérivé correspondant
-            output_file = os.path.join(output_dir, f"{base_name}_brain_extracted.nii.gz")
+        erosion_radius = 6  # défaut
 
-            # --- Choix du rayon d'érosion selon sub/ses ---
-            parts = input_file.split(os.sep)
-            sub_id = next((p for p in parts if p.startswith("sub-")), None)
-            ses_id = next((p for p in parts if p.startswith("ses-")), None)
+        # Cas particuliers demandés
+        if sub_id == "sub-04" and ses_id == "ses-4":
+            erosion_radius = 4
+        elif sub_id == "sub-06" and ses_id == "ses-4":
+            erosion_radius = 8
 
-            erosion_radius = 6  # défaut
+        print(f"Traitement du fichier : {input_file}")
+        print(f"  -> Param morpho: erosion_radius={erosion_radius} (dilatation identique)")
+        jobs.append((input_file, output_file, erosion_radius))
 
-            # Cas particuliers demandés
-            if sub_id == "sub-04" and ses_id == "ses-4":
-                erosion_radius = 4
-            elif sub_id == "sub-06" and ses_id == "ses-4":
-                erosion_radius = 8
+    if not jobs:
+        print("Aucun masque à calculer.")
+        return
 
-            print(f"Traitement du fichier : {input_file}")
-            print(f"  -> Param morpho: erosion_radius={erosion_radius} (dilatation identique)")
+    # Baux partagés : plusieurs nœuds peuvent parcourir la même arborescence
+    queue = work_queue.WorkQueue(root_dir, "brain_extraction")
+    process_files_batched(jobs, brain_root, batch_size=batch_size, queue=queue)
 
-            try:
-                process_file(input_file, output_file, brain_root, erosion_radius=erosion_radius)
-            except Exception as e:
-                print(f"Erreur lors du traitement de {input_file} : {e}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Parcours de l'arborescence pour appliquer l'extraction cérébrale et le post-traitement sur les fichiers RARE.nii.gz."
+    )
+    parser.add_argument("-r", "--root", required=True, help="Chemin racine de l'arborescence à parcourir")
+    parser.add_argument("-b", "--batch-size", type=int, default=BATCH_SIZE,
+                        help=f"Nombre de sujets par inférence antspynet (défaut : {BATCH_SIZE})")
+    args = parser.parse_args()
+
+    process_tree(args.root, batch_size=args.batch_size)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,80 @@
-import ants
 import os
+import sys
 import argparse
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_BIDS"))
+import manifest  # noqa: E402
+import nifti_writer  # noqa: E402
+import mask_store  # noqa: E402
+import work_queue  # noqa: E402
+
 EXCLUSION_LIST = [
     "sub-07_ses-3",
 ]
 
+
+def apply_mask(mask_path, acq_path, output_path):
+    """
+    Applique ``mask_path`` sur ``acq_path`` (multiplication voxel par voxel) et
+    sauvegarde dans ``output_path``. Ne fait rien si le sujet est exclu ou si
+    la sortie existe déjà.
+    """
+    # 🛑 Vérification exclusion
+    filename = os.path.basename(acq_path)  # nom du fichier acquisition
+    if any(exclusion in filename for exclusion in EXCLUSION_LIST):
+        print(f"⚠️ Sujet exclu ({filename}), aucun traitement effectué.")
+        return None
+
+    # Vérifie si le fichier de sortie existe déjà
+    if os.path.exists(output_path):
+        print(f"L'image masquée existe déjà : {output_path} — aucune opération effectuée.")
+        return None
+
+    # Bail sur la sortie : un seul nœud / processus la calcule
+    bids_root = manifest.find_bids_root(output_path)
+    if bids_root is None:
+        return _apply_mask(mask_path, acq_path, output_path)
+    lease = work_queue.WorkQueue(bids_root, "mask").claim(os.path.basename(output_path))
+    if lease is None:
+        print(f"⏩ {output_path} est calculée par un autre processus — aucune opération effectuée.")
+        return None
+    with lease:
+        if os.path.exists(output_path):
+            print(f"L'image masquée existe déjà : {output_path} — aucune opération effectuée.")
+            return None
+        return _apply_mask(mask_path, acq_path, output_path, lease)
+
+
+def _apply_mask(mask_path, acq_path, output_path, lease=None):
+    # Importé seulement ici : exclusions et sorties existantes ne chargent pas ANTs
+    import ants
+
+    acq_img = ants.image_read(acq_path)
+
+    compact_mask = mask_store.load_for(mask_path)
+    if compact_mask is not None and compact_mask.shape == tuple(acq_img.shape):
+        # Masque compact : seuls les voxels du cerveau sont copiés (le reste vaut 0)
+        masked_img = acq_img.new_image_like(compact_mask.apply(acq_img.numpy()))
+    else:
+        # Lecture du mask via ANTs et multiplication voxel par voxel
+        mask_img = ants.image_read(mask_path)
+        masked_img = acq_img * mask_img
+
+    # Bail repris par un autre processus pendant le calcul : c'est lui qui écrira la sortie
+    if lease is not None and not lease.valid():
+        return None
+
+    # Sauvegarde de l'image masquée (dossier créé si besoin, écriture atomique) ;
+    # le bail est revérifié juste avant le renommage de la sortie
+    guard = lease.valid if lease is not None else None
+    if nifti_writer.save(masked_img, output_path, "final", guard=guard) is None:
+        return None
+    manifest.record(output_path)
+
+    print(f"Mask appliqué avec succès : {output_path}")
+    return output_path
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Appliquer un masque sur une image avec ANTs en utilisant des chemins passés en arguments."
@@ -27,33 +96,9 @@ def main():
     )
     
     args = parser.parse_args()
-    
-    # 🛑 Vérification exclusion
-    filename = os.path.basename(args.acq)  # nom du fichier acquisition
-    if any(exclusion in filename for exclusion in EXCLUSION_LIST):
-        print(f"⚠️ Sujet exclu ({filename}), aucun traitement effectué.")
-        return
-    
-    # Vérifie si le fichier de sortie existe déjà
-    if os.path.exists(args.output):
-        print(f"L'image masquée existe déjà : {args.output} — aucune opération effectuée.")
-        return
-    
-    # Lecture du mask et de l'image d'acquisition via ANTs
-    mask_img = ants.image_read(args.mask)
-    acq_img = ants.image_read(args.acq)
-    
-    # Application du mask par multiplication voxel par voxel
-    masked_img = acq_img * mask_img
-    
-    # Création du répertoire de sortie s'il n'existe pas
-    output_dir = os.path.dirname(args.output)
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # Sauvegarde de l'image masquée
-    ants.image_write(masked_img, args.output)
-    
-    print(f"Mask appliqué avec succès : {args.output}")
+
+    apply_mask(args.mask, args.acq, args.output)
+
 
 if __name__ == "__main__":
     main()
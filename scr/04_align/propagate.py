@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Propagation des cartes masquées vers les espaces de référence en une seule interpolation.
+
+Remplace ``Align_SyN.sh``, ``Align_Allen.sh`` et ``apply_to_template.sh`` : au
+lieu d'appeler ``antsApplyTransforms`` pour chaque modalité (et, pour le
+template, de ré-interpoler les sorties déjà alignées), la liste complète des
+transformations d'un sujet/session est composée une seule fois en un champ de
+déplacement (``ants.apply_transforms(..., compose=...)``), gardé en cache dans
+``<dossier des transforms>/composed/``. Toutes les modalités du sujet (T1map,
+T2map, UNIT1, T2starmap, QSM, angio) sont ensuite rééchantillonnées une seule
+fois à travers ce champ. Les sujets sont traités en parallèle.
+
+Cibles (``--target``) :
+
+- ``SyN``      : RARE de référence du groupe de sessions (sorties ``alignedSyN``) ;
+- ``Allen``    : template Allen (sorties ``alignedSyN_Allen``) ;
+- ``template`` : template RARE du groupe (S01/S02/S03), transforms du template
+  composées avec celles de ``SyN`` (sorties ``To_Template/SyN/<groupe>``).
+
+Exemple ::
+
+    python propagate.py --target SyN -j 8
+    python propagate.py --target template --modality T1map --modality T2map
+"""
+
+import os
+import re
+import sys
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_BIDS"))
+import manifest  # noqa: E402
+import nifti_writer  # noqa: E402
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".."))
+
+BIDS_DIR = os.environ.get("BIDS_DIR") or os.path.join(PROJECT_ROOT, "BIDS")
+DERIV_DIR = os.environ.get("DERIV_DIR") or os.path.join(BIDS_DIR, "derivatives")
+BRAIN_EXTRACTED_DIR = os.environ.get("BRAIN_EXTRACTED_DIR") or os.path.join(DERIV_DIR, "Brain_extracted")
+
+ALLEN_TEMPLATE = os.environ.get(
+    "ALLEN_TEMPLATE",
+    "/workspace_QMRI/PROJECTS_DATA/2024_RECH_FC3R/CODE_BIDS/scr/Allen/LR/100_AMBA_ref.nii.gz",
+)
+
+# Groupes de sessions : (RARE de référence pour SyN, groupe de template)
+SESSION_GROUPS = {
+    1: ("sub-01_ses-1", "S01"),
+    2: ("sub-01_ses-1", "S01"),
+    3: ("sub-01_ses-3", "S02"),
+    4: ("sub-01_ses-3", "S02"),
+    5: ("sub-01_ses-5", "S03"),
+    6: ("sub-01_ses-5", "S03"),
+}
+
+# Modalités dont l'en-tête est recopié depuis la RARE (``CopyImageHeaderInformation ... 1 1 1``)
+HEADER_FROM_RARE = ("T2starmap", "QSM")
+
+TARGETS = ("SyN", "Allen", "template")
+
+SUBSES_RE = re.compile(r"^(sub-[^_]+)_ses-(\d+)_")
+
+
+def strip_nii(name):
+    return re.sub(r"\.nii(\.gz)?$", "", os.path.basename(name))
+
+
+def find_masked_maps(brain_dir=BRAIN_EXTRACTED_DIR, modalities=None):
+    """
+    Liste les cartes masquées (``<MOD>/*_masked.nii.gz``, hors RARE et hors
+    sous-dossiers ``aligned*``) groupées par ``(sub, ses)``.
+    """
+    if manifest.exists(BIDS_DIR):
+        paths = manifest.query(BIDS_DIR, stage="brain_extracted", desc="masked", ext=[".nii.gz", ".nii"])
+    else:
+        paths = glob.glob(os.path.join(brain_dir, "*", "*_masked.nii*"))
+
+    groups = {}
+    for path in sorted(paths):
+        acq = os.path.basename(os.path.dirname(path))
+        if acq == "RARE" or (modalities and acq not in modalities):
+            continue
+        m = SUBSES_RE.match(os.path.basename(path))
+        if not m:
+            print(f"❗ Nom inattendu (skip) : {path}")
+            continue
+        groups.setdefault((m.group(1), int(m.group(2))), []).append((acq, path))
+    return groups
+
+
+def transform_list(transform_dir, rare_base, ref_id):
+    """Transforms ``antsRegistrationSyN.sh`` d'une RARE vers ``ref_id`` (warp puis affine, comme ``-t``)."""
+    prefix = os.path.join(transform_dir, f"{rare_base}_to_{ref_id}_")
+    warp = prefix + "1Warp.nii.gz"
+    affine = prefix + "0GenericAffine.mat"
+    return [p for p in (warp, affine) if os.path.isfile(p)]
+
+
+def template_transform_list(template_dir, sub, ses):
+    """Transforms sujet -> template construites par ``Template_v2.sh`` (warp puis affine)."""
+    warp = sorted(glob.glob(os.path.join(template_dir, f"*{sub}_{ses}*_RARE*1Warp.nii.gz")))
+    affine = sorted(glob.glob(os.path.join(template_dir, f"*{sub}_{ses}*_RARE*0GenericAffine.mat")))
+    if not warp or not affine:
+        return []
+    return [warp[0], affine[0]]
+
+
+def resolve_target(target, sub, ses_num, brain_dir=BRAIN_EXTRACTED_DIR, allen_template=ALLEN_TEMPLATE):
+    """
+    Image de référence, liste de transforms, dossier de cache et règle de nommage
+    des sorties pour un sujet/session. Retourne None si rien n'est disponible.
+    """
+    if ses_num not in SESSION_GROUPS:
+        print(f"! Session inconnue (ses-{ses_num}) pour {sub}, skip.")
+        return None
+    ref_subses, group = SESSION_GROUPS[ses_num]
+    ses = f"ses-{ses_num}"
+    rare_dir = os.path.join(brain_dir, "RARE")
+    rare_base = f"{sub}_{ses}_RARE_brain_extracted"
+
+    syn_ref = os.path.join(rare_dir, f"{ref_subses}_RARE_brain_extracted.nii.gz")
+    syn_id = f"{ref_subses}_RARE"
+    syn_transforms = transform_list(os.path.join(rare_dir, "matrice_transformsSyN"), rare_base, syn_id)
+
+    if target == "SyN":
+        reference, transforms = syn_ref, syn_transforms
+        cache_dir = os.path.join(rare_dir, "matrice_transformsSyN", "composed")
+        out_dir, suffix = "alignedSyN", f"_aligned_to_{syn_id}"
+        ref_id = syn_id
+    elif target == "Allen":
+        ref_id = strip_nii(allen_template)
+        reference = allen_template
+        transforms = transform_list(os.path.join(rare_dir, "matrice_transformsSyN_Allen"), rare_base, ref_id)
+        cache_dir = os.path.join(rare_dir, "matrice_transformsSyN_Allen", "composed")
+        out_dir, suffix = "alignedSyN_Allen", f"_aligned_to_{ref_id}"
+    else:
+        template_dir = os.path.join(rare_dir, group, "templateSyN", "0.1", "template")
+        reference = os.path.join(template_dir, "RARE_template_template0.nii.gz")
+        template_transforms = template_transform_list(template_dir, sub, ses)
+        # Chaîne complète : natif -> référence SyN -> template (un seul rééchantillonnage)
+        transforms = template_transforms + syn_transforms if template_transforms and syn_transforms else []
+        cache_dir = os.path.join(template_dir, "composed")
+        out_dir, suffix = os.path.join("To_Template", "SyN", group), f"_aligned_to_{syn_id}_in_template"
+        ref_id = f"{group}_template"
+
+    if not os.path.isfile(reference):
+        print(f"! Référence absente pour {sub} {ses} : {reference}, skip.")
+        return None
+    if not transforms:
+        print(f"! Aucune transform trouvée pour {sub} {ses} ({target}), skip.")
+        return None
+
+    return {
+        "rare": os.path.join(rare_dir, f"{rare_base}.nii.gz"),
+        "reference": reference,
+        "transforms": transforms,
+        "cache": os.path.join(cache_dir, f"{rare_base}_to_{ref_id}_"),
+        "out_dir": out_dir,
+        "suffix": suffix,
+    }
+
+
+def composed_transform(reference, moving, transforms, prefix):
+    """
+    Compose ``transforms`` en un seul champ de déplacement dans la grille de
+    ``reference`` et le garde en cache (``<prefix>comptx.nii.gz``), recalculé
+    seulement si une des transforms est plus récente.
+    """
+    if len(transforms) == 1:
+        return transforms
+    cached = prefix + "comptx.nii.gz"
+    if os.path.isfile(cached) and os.path.getmtime(cached) >= max(os.path.getmtime(t) for t in transforms):
+        return [cached]
+    import ants
+
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    composed = ants.apply_transforms(fixed=reference, moving=moving, transformlist=transforms, compose=prefix)
+    return [composed]
+
+
+def interpolator_for(target, acq):
+    """
+    Interpolation des scripts d'origine : B-spline, sauf T2starmap/QSM vers SyN
+    (linéaire dans ``Align_SyN.sh``) et vers le template. Pour le template,
+    l'ancienne chaîne interpolait d'abord linéairement (SyN) puis en B-spline
+    (``apply_to_template.sh``) ; l'unique rééchantillonnage garde l'étape
+    linéaire, sans dépassements aux bords du masque pour ces cartes.
+    """
+    if target in ("SyN", "template") and acq in HEADER_FROM_RARE:
+        return "linear"
+    return "bSpline"
+
+
+def propagate_subject(target, sub, ses_num, maps, brain_dir=BRAIN_EXTRACTED_DIR,
+                      allen_template=ALLEN_TEMPLATE, overwrite=False):
+    """
+    Propage toutes les cartes ``maps`` (liste de ``(acq, chemin)``) d'un sujet/session
+    vers ``target``. Retourne la liste des fichiers écrits.
+    """
+    spec = resolve_target(target, sub, ses_num, brain_dir, allen_template)
+    if spec is None:
+        return []
+
+    pending = []
+    for acq, path in maps:
+        out_dir = os.path.join(os.path.dirname(path), spec["out_dir"])
+        out_file = os.path.join(out_dir, f"{strip_nii(path)}{spec['suffix']}.nii.gz")
+        if os.path.exists(out_file) and not overwrite:
+            print(f"⏩ {os.path.basename(out_file)} existe déjà, skip.")
+            continue
+        pending.append((acq, path, out_file))
+    if not pending:
+        return []
+
+    # ANTs n'est chargé que si une sortie est à calculer
+    import ants
+
+    reference = ants.image_read(spec["reference"])
+    rare = ants.image_read(spec["rare"]) if os.path.isfile(spec["rare"]) else None
+    if rare is None and any(acq in HEADER_FROM_RARE for acq, _, _ in pending):
+        print(f"! Pas de RARE pour {sub} ses-{ses_num}, skip.")
+        return []
+
+    transforms = composed_transform(reference, rare if rare is not None else ants.image_read(pending[0][1]),
+                                    spec["transforms"], spec["cache"])
+
+    written = []
+    for acq, path, out_file in pending:
+        image = ants.image_read(path)
+        if acq in HEADER_FROM_RARE:
+            # Équivalent de CopyImageHeaderInformation RARE IMG OUT 1 1 1
+            image = ants.copy_image_info(rare, image)
+        warped = ants.apply_transforms(fixed=reference, moving=image, transformlist=transforms,
+                                       interpolator=interpolator_for(target, acq))
+        nifti_writer.save(warped, out_file, "final")
+        written.append(out_file)
+        print(f"  ✓ {out_file}")
+
+    manifest.record(written, BIDS_DIR)
+    return written
+
+
+def propagate_all(target, modalities=None, brain_dir=BRAIN_EXTRACTED_DIR,
+                  allen_template=ALLEN_TEMPLATE, overwrite=False, jobs=None):
+    """Propage toutes les cartes masquées vers ``target``, un sujet/session par processus."""
+    groups = find_masked_maps(brain_dir, modalities)
+    print(f"=== Propagation vers {target} : {len(groups)} sujet(s)/session(s) ===")
+
+    written = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(propagate_subject, target, sub, ses_num, maps, brain_dir, allen_template, overwrite): (sub, ses_num)
+            for (sub, ses_num), maps in groups.items()
+        }
+        for future in as_completed(futures):
+            sub, ses_num = futures[future]
+            try:
+                written.extend(future.result())
+            except Exception as e:
+                print(f"❌ Erreur pour {sub} ses-{ses_num} : {e}")
+
+    print(f"=== Propagation terminée : {len(written)} fichier(s) écrit(s) ===")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Propage les cartes masquées vers la référence SyN, le template Allen ou le template RARE "
+                    "(transforms composées une fois par sujet, une seule interpolation par carte)."
+    )
+    parser.add_argument("--target", choices=TARGETS, required=True, help="Espace de destination")
+    parser.add_argument("--modality", action="append", default=None,
+                        help="Modalité à propager (répétable ; défaut : toutes)")
+    parser.add_argument("--brain-dir", default=BRAIN_EXTRACTED_DIR, help="Dossier derivatives/Brain_extracted")
+    parser.add_argument("--allen-template", default=ALLEN_TEMPLATE, help="Template Allen (cible Allen)")
+    parser.add_argument("--overwrite", action="store_true", help="Recalcule les sorties existantes")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Nombre de sujets traités en parallèle")
+    args = parser.parse_args()
+
+    propagate_all(args.target, args.modality, args.brain_dir, args.allen_template, args.overwrite, args.jobs)
+
+
+if __name__ == "__main__":
+    main()
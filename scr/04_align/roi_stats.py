@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+"""
+Statistiques régionales (atlas Allen) des cartes alignées sur Allen.
+
+Pour un volume de labels Allen (même grille que le template Allen) et toutes
+les cartes ``alignedSyN_Allen`` (T1map, T2map, T2starmap, UNIT1, angio, ...),
+calcule pour chaque label : nombre de voxels, moyenne, écart-type et médiane.
+
+Les réductions sont groupées et vectorisées : les voxels de l'atlas sont
+ramenés une seule fois à un indice de label dense, puis chaque carte est
+réduite par ``np.bincount`` (effectif, somme, somme des écarts au carré) et
+par un seul tri ``(label, valeur)`` pour les médianes — aucune boucle par label.
+Les cartes sont lues une à une et leurs lignes écrites au fil de l'eau dans un
+TSV « tidy » (une ligne par sujet / session / modalité / label), complété par
+les colonnes de ``participants.tsv`` (clé ``participant_id``).
+
+Les voxels nuls (hors masque cérébral) et non finis sont ignorés, sauf ``--keep-zeros``.
+
+Exemple ::
+
+    python roi_stats.py /chemin/annotation_100.nii.gz --label-names structures.csv
+"""
+
+import os
+import re
+import csv
+import sys
+import glob
+import argparse
+
+import numpy as np
+import nibabel as nib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_BIDS"))
+import manifest  # noqa: E402
+import nifti_writer  # noqa: E402
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".."))
+
+BIDS_DIR = os.environ.get("BIDS_DIR") or os.path.join(PROJECT_ROOT, "BIDS")
+DERIV_DIR = os.environ.get("DERIV_DIR") or os.path.join(BIDS_DIR, "derivatives")
+BRAIN_EXTRACTED_DIR = os.environ.get("BRAIN_EXTRACTED_DIR") or os.path.join(DERIV_DIR, "Brain_extracted")
+
+# Sous-dossier des cartes propagées vers Allen (``propagate.py --target Allen``)
+ALIGNED_DIR = "alignedSyN_Allen"
+
+STAT_COLUMNS = ("count", "mean", "std", "median")
+
+SUBSES_RE = re.compile(r"^(sub-[^_]+)_(ses-[^_]+)_")
+
+
+class LabelAtlas:
+    """Volume de labels ramené aux voxels étiquetés (label > 0) et à des indices denses."""
+
+    def __init__(self, path, names=None):
+        img = nib.load(path)
+        self.path = path
+        self.shape = img.shape[:3]
+        self.affine = img.affine
+        labels = np.rint(np.asanyarray(img.dataobj)).astype(np.int64).reshape(-1, order="F")
+        # Voxels étiquetés (indices à plat, ordre F comme ``dataobj``)
+        self.voxels = np.flatnonzero(labels > 0)
+        self.label_ids, self.groups = np.unique(labels[self.voxels], return_inverse=True)
+        self.names = names or {}
+
+    def __len__(self):
+        return len(self.label_ids)
+
+    def matches(self, img, atol=1e-3):
+        return img.shape[:3] == self.shape and np.allclose(img.affine, self.affine, atol=atol)
+
+    def values(self, img):
+        """Valeurs de la carte ``img`` aux voxels étiquetés (lecture unique du volume)."""
+        data = np.asanyarray(img.dataobj)
+        if data.ndim > 3:
+            data = data.reshape(data.shape[:3] + (-1,))[..., 0]
+        return data.reshape(-1, order="F")[self.voxels].astype(np.float64)
+
+
+def read_label_names(path):
+    """Table ``id -> nom`` (CSV ou TSV ; colonnes ``id`` et ``name`` / ``acronym``, sinon les deux premières)."""
+    with open(path, newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        reader = csv.reader(f, delimiter="\t" if "\t" in sample else ",")
+        rows = list(reader)
+    if not rows:
+        return {}
+    header = [h.strip().lower() for h in rows[0]]
+    if "id" in header:
+        id_col = header.index("id")
+        name_col = next((header.index(k) for k in ("name", "acronym") if k in header), 1 - id_col)
+        rows = rows[1:]
+    else:
+        id_col, name_col = 0, 1
+    names = {}
+    for row in rows:
+        try:
+            names[int(float(row[id_col]))] = row[name_col]
+        except (ValueError, IndexError):
+            continue
+    return names
+
+
+def grouped_stats(values, groups, n_groups, keep_zeros=False):
+    """
+    Effectif, moyenne, écart-type (population) et médiane de ``values`` par
+    groupe (``groups`` : indices 0..n_groups-1), en réductions vectorisées.
+    """
+    valid = np.isfinite(values)
+    if not keep_zeros:
+        valid &= values != 0
+    values, groups = values[valid], groups[valid]
+
+    count = np.bincount(groups, minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(groups, weights=values, minlength=n_groups) / count
+        # Deux passes (somme des écarts au carré) : stable même pour de grandes valeurs
+        sq = np.bincount(groups, weights=(values - mean[groups]) ** 2, minlength=n_groups)
+        std = np.sqrt(sq / count)
+
+    # Médianes : un seul tri par (groupe, valeur), puis lecture des rangs centraux
+    order = np.lexsort((values, groups))
+    ordered = values[order]
+    starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+    median = np.full(n_groups, np.nan)
+    filled = count > 0
+    lo = starts[filled] + (count[filled] - 1) // 2
+    hi = starts[filled] + count[filled] // 2
+    median[filled] = (ordered[lo] + ordered[hi]) / 2
+    return count, mean, std, median
+
+
+def aligned_modality(path):
+    """
+    Modalité d'une carte ``<modalité>/alignedSyN_Allen/<fichier>``, None si le
+    fichier n'est pas directement dans ``alignedSyN_Allen`` (ex : sous-dossier ``seuil/``).
+    """
+    parent = os.path.dirname(path)
+    if os.path.basename(parent) != ALIGNED_DIR:
+        return None
+    return os.path.basename(os.path.dirname(parent))
+
+
+def find_aligned_maps(brain_dir=BRAIN_EXTRACTED_DIR, modalities=None):
+    """
+    Cartes alignées sur Allen de ``brain_dir`` : liste triée de ``(sub, ses, modalité, chemin)``
+    (hors RARE). Le manifeste n'est interrogé que pour le dossier par défaut
+    (``BRAIN_EXTRACTED_DIR``) ; tout autre ``brain_dir`` est parcouru directement.
+    """
+    brain_dir = os.path.abspath(brain_dir)
+    if brain_dir == os.path.abspath(BRAIN_EXTRACTED_DIR) and manifest.exists(BIDS_DIR):
+        paths = [p for p in manifest.query(BIDS_DIR, stage=ALIGNED_DIR, ext=[".nii.gz", ".nii"])
+                 if p.startswith(brain_dir + os.sep)]
+    else:
+        paths = glob.glob(os.path.join(brain_dir, "*", ALIGNED_DIR, "*.nii*"))
+
+    maps = []
+    for path in sorted(paths):
+        # Même règle pour le manifeste et le glob : parent exactement <modalité>/alignedSyN_Allen
+        acq = aligned_modality(path)
+        if acq is None or acq == "RARE" or (modalities and acq not in modalities):
+            continue
+        m = SUBSES_RE.match(os.path.basename(path))
+        if not m:
+            print(f"❗ Nom inattendu (skip) : {path}")
+            continue
+        maps.append((m.group(1), m.group(2), acq, path))
+    return maps
+
+
+def read_participants(path):
+    """``participants.tsv`` -> (colonnes hors ``participant_id``, ``{participant_id: ligne}``)."""
+    if not path or not os.path.isfile(path):
+        print(f"⚠️  participants.tsv introuvable : {path}")
+        return [], {}
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f, delimiter="\t")
+        rows = {row["participant_id"]: row for row in reader}
+        columns = [c for c in reader.fieldnames or [] if c != "participant_id"]
+    return columns, rows
+
+
+def write_roi_stats(atlas, maps, output_tsv, participants_tsv=None, keep_zeros=False):
+    """
+    Calcule les statistiques de toutes les cartes ``maps`` et écrit le TSV
+    (fichier temporaire puis ``os.replace``). Retourne le nombre de cartes traitées.
+    """
+    columns, participants = read_participants(participants_tsv)
+    fieldnames = ["participant_id", "session", "modality", "label", "label_name",
+                  *STAT_COLUMNS, *columns]
+    names = [atlas.names.get(int(i), "") for i in atlas.label_ids]
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_tsv)), exist_ok=True)
+    tmp_path = nifti_writer.tmp_path(output_tsv)
+    done = 0
+    missing = set()
+    try:
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+            writer.writerow(fieldnames)
+            for sub, ses, acq, path in maps:
+                img = nib.load(path)
+                if not atlas.matches(img):
+                    print(f"❗ Grille différente de l'atlas (skip) : {path}")
+                    continue
+                count, mean, std, median = grouped_stats(atlas.values(img), atlas.groups, len(atlas), keep_zeros)
+                if sub not in participants:
+                    missing.add(sub)
+                extra = [participants.get(sub, {}).get(c, "") for c in columns]
+                for k, label in enumerate(atlas.label_ids):
+                    writer.writerow([sub, ses, acq, int(label), names[k], int(count[k]),
+                                     *(f"{x:.6g}" if count[k] else "n/a" for x in (mean[k], std[k], median[k])),
+                                     *extra])
+                done += 1
+                print(f"  ✓ {sub} {ses} {acq}")
+        os.replace(tmp_path, output_tsv)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if missing:
+        print(f"⚠️  Absents de participants.tsv : {', '.join(sorted(missing))}")
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Statistiques par label Allen (effectif, moyenne, écart-type, médiane) "
+                    "de toutes les cartes alignées sur Allen, dans un TSV unique."
+    )
+    parser.add_argument("labels", help="Volume de labels Allen (grille du template Allen)")
+    parser.add_argument("--label-names", default=None, help="Table id/nom des labels (CSV ou TSV)")
+    parser.add_argument("--modality", action="append", default=None,
+                        help="Modalité à inclure (répétable ; défaut : toutes sauf RARE)")
+    parser.add_argument("--brain-dir", default=BRAIN_EXTRACTED_DIR,
+                        help="Dossier derivatives/Brain_extracted (défaut : celui de BIDS_DIR, "
+                             "lu via le manifeste) ; un autre dossier est parcouru directement")
+    parser.add_argument("--participants", default=os.path.join(BIDS_DIR, "participants.tsv"),
+                        help="participants.tsv (colonnes ajoutées par participant_id)")
+    parser.add_argument("-o", "--output", default=None,
+                        help="TSV de sortie (défaut : derivatives/roi_stats/<atlas>_roi_stats.tsv)")
+    parser.add_argument("--keep-zeros", action="store_true", help="Inclut les voxels nuls (hors masque)")
+    args = parser.parse_args()
+
+    atlas_id = re.sub(r"\.nii(\.gz)?$", "", os.path.basename(args.labels))
+    output = args.output or os.path.join(DERIV_DIR, "roi_stats", f"{atlas_id}_roi_stats.tsv")
+
+    names = read_label_names(args.label_names) if args.label_names else None
+    atlas = LabelAtlas(args.labels, names)
+    maps = find_aligned_maps(args.brain_dir, args.modality)
+    print(f"=== {len(maps)} carte(s), {len(atlas)} label(s) ({len(atlas.voxels)} voxels) ===")
+
+    done = write_roi_stats(atlas, maps, output, args.participants, args.keep_zeros)
+    manifest.record([output], BIDS_DIR)
+    print(f"✔ {done} carte(s) -> {output}")
+
+
+if __name__ == "__main__":
+    main()
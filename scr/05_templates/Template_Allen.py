@@ -5,6 +5,10 @@ import glob
 import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_BIDS"))
+import manifest  # noqa: E402
+import nifti_writer  # noqa: E402
+
 # if len(sys.argv) != 3:
 #     print(f"Usage : {sys.argv[0]} <input_dir> <output_dir>")
 #     print("  <input_dir>  : dossier contenant les images déjà alignées sur Allen")
@@ -23,10 +27,17 @@ print(f"📂 Dossier d'entrée : {INPUT_DIR}")
 print(f"📂 Dossier de sortie : {OUTPUT_DIR}")
 
 # On cherche des fichiers type sub-XX_ses-YY_*.nii(.gz) alignés sur Allen
-files = sorted(
-    glob.glob(os.path.join(INPUT_DIR, "sub-*_ses-*.nii.gz"))
-    + glob.glob(os.path.join(INPUT_DIR, "sub-*_ses-*.nii"))
-)
+BIDS_DIR = manifest.find_bids_root(INPUT_DIR)
+if BIDS_DIR and manifest.exists(BIDS_DIR):
+    files = [
+        f for f in manifest.query(BIDS_DIR, stage=os.path.basename(INPUT_DIR), ext=[".nii.gz", ".nii"])
+        if os.path.dirname(f) == INPUT_DIR and os.path.basename(f).startswith("sub-")
+    ]
+else:
+    files = sorted(
+        glob.glob(os.path.join(INPUT_DIR, "sub-*_ses-*.nii.gz"))
+        + glob.glob(os.path.join(INPUT_DIR, "sub-*_ses-*.nii"))
+    )
 
 print(f"→ {len(files)} fichiers trouvés")
 if len(files) == 0:
@@ -54,13 +65,15 @@ median_data = np.median(stack, axis=-1)
 # Sauvegarde en template moyen
 mean_img = nib.Nifti1Image(mean_data, ref_img.affine, ref_img.header)
 mean_path = os.path.join(OUTPUT_DIR, "group_template_mean_in_Allen.nii.gz")
-mean_img.to_filename(mean_path)
+nifti_writer.save(mean_img, mean_path, "final")
+manifest.record(mean_path, BIDS_DIR)
 print(f"✅ Template mean sauvegardé : {mean_path}")
 
 # Sauvegarde en template médian
 median_img = nib.Nifti1Image(median_data, ref_img.affine, ref_img.header)
 median_path = os.path.join(OUTPUT_DIR, "group_template_median_in_Allen.nii.gz")
-median_img.to_filename(median_path)
+nifti_writer.save(median_img, median_path, "final")
+manifest.record(median_path, BIDS_DIR)
 print(f"✅ Template median sauvegardé : {median_path}")
 
 print("🎉 Terminé.")
@@ -13,8 +13,6 @@ using Statistics
 
 using NIfTI
 using MRIFiles
-using LsqFit
-using Metrics
 
 using SEQ_BRUKER_a_MP2RAGE_CS_360
 using PyCall
@@ -54,6 +52,10 @@ const FC3R_CONFIG = Dict(
     # Output location for derived Brain_extracted maps (T1/T2/UNIT1/T2*)
     :brain_extracted_root =>
         joinpath(PROJECT_ROOT, "BIDS","derivatives", "Brain_extracted"),
+
+    # Keep ants/antspynet (and the mouse model) loaded in a background worker
+    # (03_masks/ants_worker.py) instead of cold-starting Python for each step
+    :use_ants_worker => true,
 )
 
 # Convenience helpers
@@ -66,6 +68,89 @@ scripts_root() = joinpath(FC3R_CONFIG[:project_root], "scr")
 # Ex: step = "01_BIDS", "02_reco", ...
 step_path(step::AbstractString, file::AbstractString) = joinpath(scripts_root(), step, file)
 
+"""
+    update_manifest()
+
+Scan the BIDS tree once and refresh the SQLite manifest of BIDS/derivatives
+files (`01_BIDS/manifest.py`, one database per node). Python writers record
+their outputs, and every query first re-lists the folders whose mtime changed,
+so files written here (Julia) or by shell tools are picked up as well.
+"""
+function update_manifest()
+    manifest_script = step_path("01_BIDS", "manifest.py")
+    run(`$(FC3R_CONFIG[:python_bin]) $manifest_script scan $(bids_root())`)
+end
+
+"""
+    manifest_query(; filters...) -> Vector{String}
+
+Return the files of the manifest matching `filters` (sub, ses, acq, run,
+modality, desc, stage, ext). Each filter accepts a value or a vector of values.
+
+Example: `manifest_query(stage = "brain_extracted", modality = "T2map", ses = "ses-3")`
+"""
+function manifest_query(; filters...)
+    manifest_script = step_path("01_BIDS", "manifest.py")
+    args = String[]
+    for (key, value) in filters
+        for v in (value isa AbstractVector ? value : [value])
+            push!(args, "--$(key)", string(v))
+        end
+    end
+    return readlines(`$(FC3R_CONFIG[:python_bin]) $manifest_script query $(bids_root()) $args`)
+end
+
+# Unix socket of the ANTs worker (one per pipeline process)
+ants_worker_socket() = joinpath(get(ENV, "XDG_RUNTIME_DIR", "/tmp"), "fc3r_ants_worker-$(getpid()).sock")
+
+"""
+    start_ants_worker(; timeout=600) -> Union{Base.Process,Nothing}
+
+Start `03_masks/ants_worker.py` in the background and wait until its socket
+exists (the antspynet model is loaded before the socket is opened).
+Python steps then go through `ants_client.py`, which falls back to a local
+run if the worker is not available.
+"""
+function start_ants_worker(; timeout::Real = 600)
+    FC3R_CONFIG[:use_ants_worker] || return nothing
+
+    socket_path = ants_worker_socket()
+    ENV["FC3R_ANTS_SOCKET"] = socket_path
+    worker_script = step_path("03_masks", "ants_worker.py")
+    proc = run(`$(FC3R_CONFIG[:python_bin]) $worker_script --socket $socket_path`; wait = false)
+
+    t0 = time()
+    while !ispath(socket_path) && process_running(proc) && time() - t0 < timeout
+        sleep(0.5)
+    end
+
+    if ispath(socket_path)
+        println("🟢 ANTs worker started: $socket_path")
+    else
+        println("⚠️ ANTs worker did not start, Python steps will run standalone.")
+    end
+    return proc
+end
+
+"""
+    stop_ants_worker(proc)
+
+Ask the ANTs worker to shut down and wait for it (nothing to do if it has
+already exited). Called from a `finally` block in `main`.
+"""
+function stop_ants_worker(proc)
+    proc === nothing && return
+    process_running(proc) || return
+    client_script = step_path("03_masks", "ants_client.py")
+    try
+        run(`$(FC3R_CONFIG[:python_bin]) $client_script shutdown`)
+        wait(proc)
+    catch e
+        println("⚠️ Error while stopping the ANTs worker: $e")
+        kill(proc)
+    end
+end
+
 
 # =====================================================================
 # PART 1 – Raw Bruker → TSV metadata (sessions, methods, etc.)
@@ -461,7 +546,7 @@ function reconstruct_all_sequences(df::DataFrame, rare_library::Dict{String,Stri
 end
 
 # =====================================================================
-# PART 3 – Orientation check and MRtrix pipeline
+# PART 3 – Orientation check and reorientation
 # =====================================================================
 
 """
@@ -505,44 +590,42 @@ function check_dimensions(info::String)::Bool
 end
 
 """
-    apply_mrtrix_pipeline(file, final_folder, rare_path) -> String
+    apply_reorientation_batch(files, final_folder, rare_library)
+
+Reorient all flagged `files` in a single Python call (`02_reco/reorient.py`).
 
-Apply a MRtrix-based correction pipeline:
+For each file, the former MRtrix chain
 
 1. mrconvert --axes 1,0,2
 2. mrtransform --flip 1
 3. mrconvert --strides 1,2,3
 4. mrtransform --replace <rare_path>
 
-The original file is backed up as <file>.bak and restored if something fails.
+is composed into one array operation + one affine, written once and
+atomically (the original is left untouched if something fails). Files are
+processed in parallel. The RARE references are passed through a TSV written
+into `final_folder`.
+
+If any file fails, `reorient.py` lists the failures and exits non-zero; the
+error is rethrown so that unfixed volumes do not go unnoticed.
 """
-function apply_mrtrix_pipeline(file::String, final_folder::String, rare_path::String)::String
-    base = basename(file)
-    backup_file = file * ".bak"
-    tmp_file = joinpath(final_folder, "tmp_" * base)
+function apply_reorientation_batch(files::Vector{String},
+                                   final_folder::String,
+                                   rare_library::Dict{String, String})
+    isempty(files) && return files
 
-    cp(file, backup_file; force = true)
-    cp(file, tmp_file; force = true)
+    library_tsv = joinpath(final_folder, "rare_library.tsv")
+    save_rare_library_tsv(rare_library, library_tsv)
 
+    python_script = step_path("02_reco", "reorient.py")
     try
-        run(`mrconvert --axes 1,0,2 $tmp_file $tmp_file -force`)
-        run(`mrtransform --flip 1 $tmp_file $tmp_file -force`)
-        run(`mrconvert --strides 1,2,3 $tmp_file $tmp_file -force`)
-        run(`mrtransform $tmp_file --replace $rare_path $tmp_file -force`)
-
-        mv(tmp_file, file; force = true)
-        rm(backup_file; force = true)
-
-        println("Successfully reoriented: $file")
-        return file
-
+        run(`$(FC3R_CONFIG[:python_bin]) $python_script --rare-library $library_tsv $files`)
     catch e
-        println("Error while transforming $file: $e")
-        println("Restoring original file...")
-        mv(backup_file, file; force = true)
-        isfile(tmp_file) && rm(tmp_file; force = true)
-        return file
+        println("❌ Reorientation failed for some flagged files (see list above), originals left unchanged.")
+        rethrow()
     end
+
+    return files
 end
 
 """
@@ -551,13 +634,16 @@ end
 Walk through the BIDS directory and, for each NIfTI file:
 - run `mrinfo`
 - if dimensions are not 144 x 192 x 144, try to find a RARE reference
-  from `rare_library` and apply the MRtrix pipeline.
+  from `rare_library` and flag the file for reorientation.
+
+All flagged files are then reoriented in one parallel batch.
 """
 function fix_bids_nifti_modified(bids_dir::String,
                                  final_folder::String,
                                  rare_library::Dict{String, String})
 
     println("Checking NIfTI orientation in BIDS: $bids_dir")
+    flagged = String[]
 
     for (root, _, files) in walkdir(bids_dir)
         if "derivatives" in splitpath(root)
@@ -571,15 +657,13 @@ function fix_bids_nifti_modified(bids_dir::String,
 
                 info = get_mrinfo_output(file_path)
                 if !check_dimensions(info)
-                    println("🔧 Incorrect orientation, applying MRtrix pipeline...")
+                    println("🔧 Incorrect orientation, flagged for reorientation...")
 
                     m = match(r"(sub-[^_]+)_(ses-[^_]+)", file)
                     if m !== nothing
                         id = "$(m.captures[1])_$(m.captures[2])"
                         if haskey(rare_library, id)
-                            rare_path = rare_library[id]
-                            modified_file = apply_mrtrix_pipeline(file_path, final_folder, rare_path)
-                            println("✅ Modified file: $modified_file")
+                            push!(flagged, file_path)
                         else
                             println("❌ No RARE reference found for ID: $id – skipping transform.")
                         end
@@ -592,6 +676,9 @@ function fix_bids_nifti_modified(bids_dir::String,
             end
         end
     end
+
+    println("🔧 Reorienting $(length(flagged)) flagged file(s)...")
+    apply_reorientation_batch(flagged, final_folder, rare_library)
 end
 
 # =====================================================================
@@ -601,25 +688,13 @@ end
 """
     apply_masks_to_quantitative_maps()
 
-Search for all T1map, T2map and UNIT1 NIfTI files in BIDS `anat/` folders,
-and apply the corresponding RARE mask to create masked maps in
+Query the manifest for all T1map, T2map and UNIT1 NIfTI files in BIDS
+`anat/` folders, and apply the corresponding RARE mask to create masked maps in
 `derivatives/Brain_extracted/<modality>/`.
 """
 function apply_masks_to_quantitative_maps()
     bids = bids_root()
-    patterns = ["*T1map.nii.gz", "*T2map.nii.gz", "*UNIT1.nii.gz"]
-    anat_paths = String[]
-
-    for sub in filter(isdir, glob("sub-*", bids))
-        for ses in filter(isdir, glob("ses-*", sub))
-            anat_dir = joinpath(ses, "anat")
-            if isdir(anat_dir)
-                for pattern in patterns
-                    append!(anat_paths, glob(pattern, anat_dir))
-                end
-            end
-        end
-    end
+    anat_paths = manifest_query(stage = "raw", modality = ["T1map", "T2map", "UNIT1"], desc = "", ext = ".nii.gz")
 
     println("Found $(length(anat_paths)) quantitative maps to mask.")
 
@@ -662,9 +737,9 @@ function apply_masks_to_quantitative_maps()
             continue
         end
 
-        # ORIGINAL BEHAVIOR: use script "mask_aaply.py" and hard-coded python bin
-        python_script = step_path("03_masks", "mask_aaply.py")
-        command = `$(FC3R_CONFIG[:python_bin]) $python_script --mask $mask_path --acq $acq_path --output $output_path`
+        # Same processing as "mask_aaply.py", sent to the ANTs worker
+        client_script = step_path("03_masks", "ants_client.py")
+        command = `$(FC3R_CONFIG[:python_bin]) $client_script mask --mask $mask_path --acq $acq_path --output $output_path`
         println("🧠 Applying mask to: $filename → $modality_folder")
         run(command)
         println("🕒 Mask application time: $(time() - local_start) seconds")
@@ -672,90 +747,19 @@ function apply_masks_to_quantitative_maps()
 end
 
 # =====================================================================
-# PART 5 – T2* mapping (original behavior)
+# PART 5 – T2* mapping
 # =====================================================================
 
-"""
-    T2_star_FC3R(MGE_path, mask)
-
-Original T2* fitting function from the FC3R pipeline.
-
-This version keeps the exact behavior of your initial script:
-- input `mask` is used directly as `mask[i,j,k] == 1`
-- same noise ROI, same model, same logic for R² check.
-"""
-function T2_star_FC3R(MGE_path, mask)
-    file = BrukerFile(MGE_path)
-    reco = recoData(file)
-    
-    reco = reco[:, end:-1:1, :, :]
-
-    x = length(reco[:, 1, 1, 1])
-    y = length(reco[1, :, 1, 1])
-    z = length(reco[1, 1, :, 1])
-    n_echo = length(reco[1, 1, 1, :])
-  
-    T2_star_map = Array{Float64}(undef, x, y, z)
-    R_map       = Array{Float64}(undef, x, y, z)
-
-    model(t, p) = sqrt.((p[1] * exp.(-t / p[2])) .^ 2 .+ 2 * 4 * p[3]^2)
-    x_abs = parse.(Float64, file["EffectiveTE"])
-
-    corner1_noise = reco[1:3, 86:106, 1:3, 1]
-    corner2_noise = reco[1:3, 86:106, end-2:end, 1]
-    corner3_noise = reco[end-2:end, 86:106, 1:3, 1]
-    corner4_noise = reco[end-2:end, 86:106, end-2:end, 1]
-
-    sum_noise = vcat(
-        reshape(corner1_noise, 3*21*3),
-        reshape(corner2_noise, 3*21*3),
-        reshape(corner3_noise, 3*21*3),
-        reshape(corner4_noise, 3*21*3),
-    )
-    noise = std(sum_noise)
-
-    for i in 1:x
-        for j in 1:y
-            for k in 1:z
-                if mask[i, j, k] == 1
-                    p0 = [maximum(abs.(reco[i, j, k, 1:n_echo])), 30, noise]
-                    try 
-                        fit = LsqFit.curve_fit(model, Float32.(x_abs), abs.(reco[i, j, k, 1:n_echo]), p0)
-                    catch
-                        T2_star_map[i, j, k] = 0
-                        R_map[i, j, k]       = 0
-                    else
-                        fit = LsqFit.curve_fit(model, Float32.(x_abs), abs.(reco[i, j, k, 1:n_echo]), p0)
-
-                        a = fit.param[1]
-                        b = fit.param[2]
-                        c = fit.param[3]
-
-                        line = sqrt.((a * exp.(-x_abs / b)) .^ 2 .+ 2 * 4 * c^2)
-                        if r2_score(line, abs.(reco[i, j, k, 1:n_echo])) < 0
-                            T2_star_map[i, j, k] = 0
-                            R_map[i, j, k]       = r2_score(line, reco[i, j, k, 1:n_echo])
-                        else
-                            T2_star_map[i, j, k] = fit.param[2]
-                            R_map[i, j, k]       = r2_score(line, reco[i, j, k, 1:n_echo])
-                        end
-                    end
-                else
-                    T2_star_map[i, j, k] = 0
-                    R_map[i, j, k]       = 0
-                end
-            end
-        end
-    end
-
-    return T2_star_map, R_map
-end
-
 """
     reconstruct_T2star(df::DataFrame)
 
 Loop on all rows, detect MGE sequences, and compute T2* and R2* maps
 into BIDS anat folder and into `Brain_extracted/T2starmap`.
+
+The fit itself is done by `02_reco/t2star_fit.py`: same noise-floor
+mono-exponential model as the former `T2_star_FC3R`, fitted on all masked
+voxels at once (batched Levenberg–Marquardt, chunks spread over cores).
+The `_R2starmap` file keeps its current content (R² of the fit).
 """
 function reconstruct_T2star(df::DataFrame)
     bids = bids_root()
@@ -792,16 +796,11 @@ function reconstruct_T2star(df::DataFrame)
             )
 
             if isfile(mask_file)
-                # EXACT original behavior: pass result of NIfTI.niread directly as `mask`
-                mymask_ni = NIfTI.niread(mask_file)
-                T2star, Rmap = T2_star_FC3R(df[i, :Filepath], mymask_ni)
-
-                niwrite(out_T2, NIVolume(T2star))
-                niwrite(out_R2, NIVolume(Rmap))
-
+                t2star_script = step_path("02_reco", "t2star_fit.py")
                 filename_T2_masked = replace(basename(out_T2), r"\.nii\.gz$" => "_masked.nii.gz")
                 copy_T2 = joinpath(brain_t2star_dir, filename_T2_masked)
-                niwrite(copy_T2, NIVolume(T2star))
+                # The masked copy is written (and recorded in the manifest) by the script itself
+                run(`$(FC3R_CONFIG[:python_bin]) $t2star_script $(df[i, :Filepath]) --mask $mask_file --out-t2 $out_T2 --out-r2 $out_R2 --out-masked $copy_T2`)
 
                 parser_script = step_path("01_BIDS", "Parser_Bruker_file.py")
                 run(`$(FC3R_CONFIG[:python_bin]) $parser_script $(df[i, :Filepath]) $anat_dir --mode T2STAR --json_name "$(prefix)_T2starmap.json"`)
@@ -820,77 +819,56 @@ end
 # =====================================================================
 
 """
-    reconstruct_angio(df::DataFrame)
+    stitch_angio_session(paths, subject_name, session_name)
 
-Reconstruct angiography images for each subject/session that has exactly
-3 FcFLASH acquisitions (method name "fcflash", case-insensitive).
+Convert the 3 FcFLASH series of one subject/session into a private temporary
+folder and stitch them with `02_reco/angio_stitch.py`, which writes
+`angio_final` directly (and atomically) into the BIDS `anat/` folder.
+Does not change the working directory, so sessions can run in parallel.
 """
-function reconstruct_angio(df::DataFrame)
+function stitch_angio_session(paths::Vector{String}, subject_name::String, session_name::String)
+    local_start = time()
     bids = bids_root()
-    project_root = FC3R_CONFIG[:project_root]
     brkraw_bin = FC3R_CONFIG[:brkraw_bin]
-    angio_script = step_path("02_reco", "angio.sh")
+    stitch_script = step_path("02_reco", "angio_stitch.py")
     parser_script = step_path("01_BIDS", "Parser_Bruker_file.py")
 
-    for row in eachrow(df)
-        local_start = time()
-        id = row.ID
-        session = row.Session
-
-        # Group all FcFLASH series for this subject/session
-        group = filter(r -> r.ID == id && r.Session == session && lowercase(r.Method) == "fcflash", df)
-        paths = group.Filepath
-
-        if length(paths) != 3
-            if length(paths) > 0
-                println("❌ Not exactly 3 FcFLASH files for sub-$id ses-$session (found: $(length(paths)))")
-            end
-            continue
-        end
-
-        subject_name = "sub-" * string(id)
-        session_name = "ses-" * string(session)
-        anat_dir = joinpath(bids, subject_name, session_name, "anat")
-        mkpath(anat_dir)
-        final_bids_name = joinpath(anat_dir, "$(subject_name)_$(session_name)_angio.nii.gz")
-
-        if isfile(final_bids_name)
-            println("⏩ Angio already reconstructed: $final_bids_name")
-            continue
-        end
+    anat_dir = joinpath(bids, subject_name, session_name, "anat")
+    mkpath(anat_dir)
+    final_bids_name = joinpath(anat_dir, "$(subject_name)_$(session_name)_angio.nii.gz")
 
-        # Temporary working directory
-        temp_dir = joinpath(project_root, "temp_angio", "sub-$(id)_ses-$(session)")
-        mkpath(temp_dir)
+    if isfile(final_bids_name)
+        println("⏩ Angio already reconstructed: $final_bids_name")
+        return
+    end
 
-        # Convert Bruker → NIfTI and then run angio script
-        split_paths = split(paths[1], "/")
-        basepath = joinpath(split_paths[1:end-1]...)
+    # Temporary working directory (one per subject/session)
+    temp_dir = joinpath(FC3R_CONFIG[:project_root], "temp_angio", "$(subject_name)_$(session_name)")
+    mkpath(temp_dir)
 
+    try
+        # Convert Bruker → NIfTI into temp_dir
+        basepath = dirname(paths[1])
         nii_files = String[]
 
-        cd(temp_dir) do
-            for path in paths
-                endpath = split(path, "/")[end]
-                filename = "*-$endpath-1-FcFLASH_1-(E$endpath).nii.gz"
-                push!(nii_files, filename)
-
-                # Convert current FcFLASH series
-                run(`$brkraw_bin tonii /$basepath -s $endpath`)
-            end
+        for path in paths
+            endpath = basename(path)
+            run(`$brkraw_bin tonii $basepath -s $endpath -o $temp_dir/`)
+            append!(nii_files, glob("*-$endpath-1-FcFLASH_1-(E$endpath).nii.gz", temp_dir))
+        end
 
-            # Run angio shell script
-            run(`bash $angio_script $(nii_files[1]) $(nii_files[2]) $(nii_files[3])`)
+        if length(nii_files) != 3
+            println("❌ Expected 3 FcFLASH NIfTI for $subject_name $session_name (found: $(length(nii_files)))")
+            return
         end
 
-        # Copy final angio NIfTI into BIDS
-        final_temp_path = joinpath(temp_dir, "angio_final.nii.gz")
-        cp(final_temp_path, final_bids_name; force = true)
-        println("✅ Angio copied to BIDS: $final_bids_name")
+        # Stitch the 3 slabs, written once into BIDS
+        run(`$(FC3R_CONFIG[:python_bin]) $stitch_script $nii_files -o $final_bids_name`)
+        println("✅ Angio written to BIDS: $final_bids_name")
 
         # Generate JSON sidecar using first FcFLASH Bruker directory
-        run(`$(FC3R_CONFIG[:python_bin]) $parser_script $(paths[1]) $anat_dir --mode T2STAR --json_name "sub-$(id)_ses-$(session)_angio.json"`)
-
+        run(`$(FC3R_CONFIG[:python_bin]) $parser_script $(paths[1]) $anat_dir --mode T2STAR --json_name "$(subject_name)_$(session_name)_angio.json"`)
+    finally
         # Cleanup
         try
             rm(temp_dir; force = true, recursive = true)
@@ -898,8 +876,45 @@ function reconstruct_angio(df::DataFrame)
         catch e
             println("⚠️ Error while removing $temp_dir: $e")
         end
+    end
 
-        println("🕒 Angio reconstruction time: $(time() - local_start) seconds")
+    println("🕒 Angio reconstruction time ($subject_name $session_name): $(time() - local_start) seconds")
+end
+
+"""
+    reconstruct_angio(df::DataFrame)
+
+Reconstruct angiography images for each subject/session that has exactly
+3 FcFLASH acquisitions (method name "fcflash", case-insensitive).
+Sessions are stitched in parallel (Julia threads).
+"""
+function reconstruct_angio(df::DataFrame)
+    jobs = Tuple{Vector{String}, String, String}[]
+
+    for key in unique(zip(df.ID, df.Session))
+        id, session = key
+
+        # Group all FcFLASH series for this subject/session
+        group = filter(r -> r.ID == id && r.Session == session && lowercase(r.Method) == "fcflash", df)
+        paths = String.(group.Filepath)
+
+        if length(paths) != 3
+            if length(paths) > 0
+                println("❌ Not exactly 3 FcFLASH files for sub-$id ses-$session (found: $(length(paths)))")
+            end
+            continue
+        end
+
+        push!(jobs, (paths, "sub-" * string(id), "ses-" * string(session)))
+    end
+
+    Threads.@threads for job in jobs
+        paths, subject_name, session_name = job
+        try
+            stitch_angio_session(paths, subject_name, session_name)
+        catch e
+            println("❌ Angio reconstruction failed for $subject_name $session_name: $e")
+        end
     end
 end
 
@@ -918,26 +933,31 @@ end
 """
     run_alignment_and_templates()
 
-Run the external shell scripts that:
-- compute transformations (Find_Matrice_SyN.sh, Align_SyN.sh)
+Run the alignment and template steps:
+- compute transformations (Find_Matrice_SyN.sh)
+- propagate masked maps to the SyN references (propagate.py --target SyN)
 - threshold T2* maps (Seuil_T2star.sh)
 - build RARE templates for S01/S02 (Template_v2.sh)
-- propagate modalities to the template (apply_to_template.sh)
+- propagate masked maps to the RARE templates (propagate.py --target template)
 - build final templates for each modality (Make_Template.sh)
+
+`propagate.py` composes each subject's transforms once and resamples every
+modality a single time, subjects running in parallel.
 """
 function run_alignment_and_templates()
     local_start = time()
+    propagate_py = step_path("04_align", "propagate.py")
 
     run(`bash $(step_path("04_align","Find_Matrice_SyN.sh"))`)
-    run(`bash $(step_path("04_align","Align_SyN.sh"))`)
+    run(`$(FC3R_CONFIG[:python_bin]) $propagate_py --target SyN`)
     run(`bash $(step_path("04_align","Seuil_T2star.sh"))`)
 
     run(`bash $(step_path("05_templates","Template_v2.sh")) RARE S01 4`)
     run(`bash $(step_path("05_templates","Template_v2.sh")) RARE S02 4`)
 
-    # Propagate modalities onto the template
+    # Propagate modalities onto the template (native -> SyN reference -> template in one resampling)
+    run(`$(FC3R_CONFIG[:python_bin]) $propagate_py --target template`)
     for mod in ["T1map","UNIT1","T2map","angio","T2starmap","QSM"]
-        run(`bash $(step_path("05_templates","apply_to_template.sh")) $mod`)
         run(`bash $(step_path("05_templates","Make_Template.sh")) $mod`)
     end
     
@@ -975,21 +995,30 @@ function main()
     reconstruct_all_sequences(df, rare_lib)
 
     #5.1 OPTIONAL IF SOME REONCSTRUCTION NOT IN THE SAME ORIENTATION
-    run(`./Reorient_if_bug.sh`)
-
-    # 6) Brain extraction (Python)
-    brain_extraction_script = step_path("03_masks", "brain_extraction.py")
-    run(`$(FC3R_CONFIG[:python_bin]) $brain_extraction_script -r $bids`)
+    run(addenv(`./Reorient_if_bug.sh`, "PYTHON_BIN" => FC3R_CONFIG[:python_bin]))
 
-    # 7) Orientation fix
-    final_modified_folder = joinpath(pwd(), "modified")
-    mkpath(final_modified_folder)
-    fix_bids_nifti_modified(bids, final_modified_folder, rare_lib)
-    isdir(final_modified_folder) && rm(final_modified_folder; recursive = true, force = true)
-    println("Temporary folder 'modified' has been removed.")
+    # 5.2) Index BIDS/derivatives files once (later steps query the manifest)
+    update_manifest()
 
-    # 8) Apply masks to T1map / T2map / UNIT1
-    apply_masks_to_quantitative_maps()
+    # 6) Brain extraction (Python, through the ANTs worker)
+    # The worker (TensorFlow loaded, socket bound) is stopped even if steps 6-8 throw
+    ants_worker = start_ants_worker()
+    try
+        client_script = step_path("03_masks", "ants_client.py")
+        run(`$(FC3R_CONFIG[:python_bin]) $client_script extract --root $bids`)
+
+        # 7) Orientation fix
+        final_modified_folder = joinpath(pwd(), "modified")
+        mkpath(final_modified_folder)
+        fix_bids_nifti_modified(bids, final_modified_folder, rare_lib)
+        isdir(final_modified_folder) && rm(final_modified_folder; recursive = true, force = true)
+        println("Temporary folder 'modified' has been removed.")
+
+        # 8) Apply masks to T1map / T2map / UNIT1
+        apply_masks_to_quantitative_maps()
+    finally
+        stop_ants_worker(ants_worker)
+    end
 
     # 9) T2* reconstruction
     reconstruct_T2star(df)
@@ -3,6 +3,10 @@ set -euo pipefail
 shopt -s nullglob
 
 BIDS_DIR="/workspace_QMRI/PROJECTS_DATA/2024_RECH_FC3R/CODE_BIDS/BIDS"   # <-- à adapter
+PYTHON_BIN="${PYTHON_BIN:-python3}"
+
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+REORIENT_PY="$SCRIPT_DIR/02_reco/reorient.py"
 
 # Liste: "SUB SES MOD"
 ITEMS=(
@@ -18,6 +22,7 @@ ITEMS=(
   "15 3 T2map"
 )
 
+FILES=()
 for it in "${ITEMS[@]}"; do
   read -r SUB SES MOD <<< "$it"
 
@@ -26,7 +31,6 @@ for it in "${ITEMS[@]}"; do
   ANAT_DIR="${BIDS_DIR}/${SUB_ID}/${SES_ID}/anat"
 
   IN_FILE="${ANAT_DIR}/${SUB_ID}_${SES_ID}_${MOD}.nii.gz"
-  TMP_FILE="${ANAT_DIR}/.${SUB_ID}_${SES_ID}_${MOD}_tmp.nii.gz"
 
   if [[ ! -f "$IN_FILE" ]]; then
     echo "[WARN] Introuvable: $IN_FILE" >&2
@@ -34,13 +38,14 @@ for it in "${ITEMS[@]}"; do
   fi
 
   echo "[INFO] Overwrite: $IN_FILE"
-
-  # flip puis strides, écrit dans tmp
-  mrtransform "$IN_FILE" -flip 1 - \
-    | mrconvert - -strides 1,2,3 "$TMP_FILE" -force
-
-  # remplace l'original (atomique sur même filesystem)
-#   mv -f "$TMP_FILE" "$IN_FILE"
+  FILES+=("$IN_FILE")
 done
 
+# flip puis strides en une seule passe (lecture/compression unique, en parallèle),
+# écrit dans .<SUB>_<SES>_<MOD>_tmp.nii.gz à côté de l'original.
+# Retirer --keep-original pour remplacer l'original (atomique sur même filesystem).
+if [[ ${#FILES[@]} -gt 0 ]]; then
+  "$PYTHON_BIN" "$REORIENT_PY" --axes 0,1,2 --flip 1 --keep-original "${FILES[@]}"
+fi
+
 echo "[DONE] Terminé."